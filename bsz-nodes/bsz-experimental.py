@@ -4,6 +4,34 @@ import torch
 import numpy
 import PIL
 
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, repeat
+from os import cpu_count
+
+class BSZInjectionSchedule:
+    # {{{
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required":
+                    {"injection": ("LATENT", ),
+                    "time": ("FLOAT", {"default": 0.3, "min": 0.0, "max": 1.0, "step":0.01}),
+                    "strength": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 1.0, "step":0.05}),
+                    },
+                "optional":
+                    {"schedule": ("BSZ_INJECTION_SCHEDULE", ),
+                    }
+                }
+
+    RETURN_TYPES = ("BSZ_INJECTION_SCHEDULE",)
+    RETURN_NAMES = ("schedule",)
+    FUNCTION = "schedule"
+
+    CATEGORY = "beinsezii/experimental"
+
+    def schedule(self, injection, time, strength, schedule=None):
+        return ((schedule or []) + [(time, injection, strength)],)
+    #}}}
+
 class BSZInjectionKSampler:
     # {{{
     @classmethod
@@ -22,7 +50,10 @@ class BSZInjectionKSampler:
                     "injection": ("LATENT", ),
                     "time": ("FLOAT", {"default": 0.3, "min": 0.0, "max": 1.0, "step":0.01}),
                     "strength": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 1.0, "step":0.05}),
-                     }
+                     },
+                "optional":
+                    {"schedule": ("BSZ_INJECTION_SCHEDULE", ),
+                    }
                 }
 
     RETURN_TYPES = ("LATENT",)
@@ -30,12 +61,22 @@ class BSZInjectionKSampler:
 
     CATEGORY = "beinsezii/experimental"
 
-    def sample(self, model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise, injection, time, strength):
-        assert latent_image['samples'].shape == injection['samples'].shape
-        split = round(steps * time)
-        latent_image = nodes.common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_step=0, last_step=split, disable_noise=False, force_full_denoise=False, denoise=denoise)[0]
-        latent_image['samples'] += injection['samples'].mul(strength)
-        return nodes.common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_step=split, last_step=None, disable_noise=True, force_full_denoise=True, denoise=denoise)
+    def sample(self, model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, denoise, injection, time, strength, schedule=None):
+        # Sampling stops at every split without fully denoising, the injections are added, then it
+        # resumes from there without fresh noise, exactly like the original two pass version
+        injections = {}
+        for time, injection, strength in [(time, injection, strength)] + (schedule or []):
+            assert latent_image['samples'].shape == injection['samples'].shape
+            split = min(max(round(steps * time), 0), steps)
+            injection = injection['samples'].mul(strength)
+            injections[split] = injection if split not in injections else injections[split] + injection
+
+        start = 0
+        for n, split in enumerate(sorted(injections)):
+            latent_image = nodes.common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_step=start, last_step=split, disable_noise=n > 0, force_full_denoise=False, denoise=denoise)[0]
+            latent_image = latent_image | {'samples': latent_image['samples'] + injections[split]}
+            start = split
+        return nodes.common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, start_step=start, last_step=None, disable_noise=True, force_full_denoise=True, denoise=denoise)
 
     #}}}
 
@@ -47,6 +88,12 @@ pil_modes = {
         "PIL_Bicubic": PIL.Image.Resampling.BICUBIC,
         "PIL_Lanczos": PIL.Image.Resampling.LANCZOS,
 }
+# torch kernels that match PIL's own filters on float images to within float error.
+# Nearest isn't one of them, torch and PIL round half pixel ties differently, see nearest_resample
+torch_modes = {
+        "PIL_Bilinear": {"mode": "bilinear", "antialias": True, "align_corners": False},
+        "PIL_Bicubic": {"mode": "bicubic", "antialias": True, "align_corners": False},
+}
 class BSZStrangeResample:
     #{{{
     @classmethod
@@ -59,6 +106,9 @@ class BSZStrangeResample:
                 "height": ("INT", {"default": 1024, "min": 64, "max": nodes.MAX_RESOLUTION, "step": 8}),
                 "bleed": ("FLOAT", {"default": 0.0, "min": -1.0, "max": 1.0, "step": 0.01}),
             },
+            "optional": {
+                "passes": ("INT", {"default": 1, "min": 1, "max": 4}),
+            },
         }
 
     RETURN_TYPES = ("LATENT",)
@@ -66,86 +116,101 @@ class BSZStrangeResample:
     CATEGORY = "beinsezii/experimental"
 
     def bleed(self, t, bleed):
-        result = torch.empty([4])
-        result[0] = t[1] * bleed + t[3] * bleed
-        result[1] = t[0] * bleed + t[2] * bleed
-        result[2] = t[3] * bleed + t[1] * bleed
-        result[3] = t[2] * bleed + t[0] * bleed
-        result.div_(2)
-        return result
-
-    def resample(self, latent, method, width, height, bleed):
+        """Channel swapped bleed of [B, 4, H, W] neighbours"""
+        result = t[:, [1, 0, 3, 2]] * bleed + t[:, [3, 2, 1, 0]] * bleed
+        return result.to(torch.float32).div_(2)
+
+    def slurry2(self, samples, bleed):
+        """2x upscale where each new pixel averages its source pixel with the in-bounds neighbours
+        along the axes it was offset on, then gets their bleed added.
+        Out of bounds neighbours are zero padding so every sum keeps the same order of adds"""
+        b, c, h, w = samples.shape
+        zeros = torch.zeros_like(samples[:, :, :, :1])
+        right = torch.cat([samples[:, :, :, 1:], zeros], dim=3)
+        left = torch.cat([zeros, samples[:, :, :, :-1]], dim=3)
+        zeros = torch.zeros_like(samples[:, :, :1])
+        up = torch.cat([zeros, samples[:, :, :-1]], dim=2)
+        down = torch.cat([samples[:, :, 1:], zeros], dim=2)
+        del zeros
+
+        xs, ys = torch.arange(w).view(1, 1, 1, w), torch.arange(h).view(1, 1, h, 1)
+        xn = (xs < w - 1).long() + (xs > 0).long()
+        yn = (ys > 0).long() + (ys < h - 1).long()
+        # the original python float math, only then rounded to float32
+        denominators = torch.tensor([1 + (bleed / (1 + bleed)) * n for n in range(6)], dtype=torch.float32)
+
+        def blend(neighbours, n):
+            end = samples.clone()
+            for t in neighbours:
+                end += t
+            end /= n.to(torch.float32)
+            for t in neighbours:
+                end += self.bleed(t, bleed)
+            end /= denominators[n]
+            return end
+
+        tensor = torch.empty([b, c, h * 2, w * 2], dtype=torch.float32, device=samples.device)
+        tensor[:, :, 0::2, 0::2] = samples
+        tensor[:, :, 0::2, 1::2] = blend([right, left], 1 + xn)
+        tensor[:, :, 1::2, 0::2] = blend([up, down], 1 + yn)
+        tensor[:, :, 1::2, 1::2] = blend([right, left, up, down], 1 + xn + yn)
+        return tensor
+
+    def pil_resample(self, samples, mode, width, height):
+        """Resizes every channel of every batch item as its own float image, spread across threads.
+        PIL drops the GIL while resizing so the channels really do run in parallel"""
+        b, c, h, w = samples.shape
+        planes = samples.to(torch.float32).cpu().reshape(b * c, h, w).numpy()
+        result = torch.empty([b * c, height, width], dtype=torch.float32)
+        target = result.numpy()
+        def resize(n):
+            img = PIL.Image.fromarray(planes[n], 'F').resize((width, height), resample=mode)
+            target[n] = numpy.asarray(img)
+        with ThreadPoolExecutor(min(b * c, cpu_count() or 1)) as pool:
+            for _ in pool.map(resize, range(b * c)):
+                pass
+        return result.reshape(b, c, height, width).to(samples.device)
+
+    def nearest_resample(self, samples, width, height):
+        """PIL's nearest neighbour walks the source in double precision, starting half a step in
+        and adding the scale once per pixel, then truncates. Gathering the indices that walk
+        lands on reproduces it exactly for the whole batch at once"""
+        b, c, h, w = samples.shape
+        def indices(size, source):
+            scale = source / size
+            index = [int(x) for x in accumulate(repeat(scale, size - 1), initial=scale * 0.5)]
+            return torch.tensor(index).clamp(0, source - 1).to(samples.device)
+        samples = samples.to(torch.float32).index_select(2, indices(height, h))
+        return samples.index_select(3, indices(width, w))
+
+    def resample(self, latent, method, width, height, bleed, passes=1):
         b, c, h, w = latent["samples"].shape
         result = latent.copy()
-        if method in list(pil_modes.keys()):
-            tensors = []
-            for batch in latent["samples"]:
-                channels = []
-                for channel in batch:
-                    tensor = channel.to(torch.float32).numpy().copy()
-                    img: PIL.Image.Image = PIL.Image.fromarray(tensor, 'F').resize((width // 8, height // 8), resample=pil_modes[method])
-                    tensor = torch.from_numpy(numpy.asarray(img))
-                    shape = [1] + list(tensor.shape)
-                    channels.append(tensor.reshape(shape))
-                tensor = torch.cat(channels)
-                shape = [1] + list(tensor.shape)
-                tensors.append(tensor.reshape(shape))
-            result['samples'] = torch.cat(tensors)
+        if method == "PIL_Nearest":
+            result['samples'] = self.nearest_resample(latent["samples"], width // 8, height // 8)
+        elif method in torch_modes:
+            result['samples'] = torch.nn.functional.interpolate(
+                latent["samples"].to(torch.float32), (height // 8, width // 8), **torch_modes[method]
+            )
+        elif method in pil_modes:
+            result['samples'] = self.pil_resample(latent["samples"], pil_modes[method], width // 8, height // 8)
         if method == 'slurry2':
-            bleed *= (1 / 16)
-            tensor = torch.zeros([b, w*2, h*2, c])
-            old = result['samples'].permute(0, 3, 2, 1)
-            for bn, batch in enumerate(tensor):
-                for xn, x in enumerate(batch):
-                    for yn, y in enumerate(x):
-                        xo, yo = xn // 2, yn // 2
-                        nearest = old[bn][xo][yo]
-                        if xn % 2 == 1 or yn % 2 == 1:
-                            end = nearest.clone()
-                            bleeds = []
-                            n = 1
-
-                            if xo < w-1 and xn % 2:
-                                t = old[bn][xo+1][yo]
-                                end += t
-                                bleeds.append(self.bleed(t, bleed))
-                                n += 1
-                            if xo > 0 and xn % 2:
-                                t = old[bn][xo-1][yo]
-                                end += t
-                                bleeds.append(self.bleed(t, bleed))
-                                n += 1
-                            if yo > 0 and yn % 2:
-                                t = old[bn][xo][yo-1]
-                                end += t
-                                bleeds.append(self.bleed(t, bleed))
-                                n += 1
-                            if yo < h-1 and yn % 2:
-                                t = old[bn][xo][yo+1]
-                                end += t
-                                bleeds.append(self.bleed(t, bleed))
-                                n += 1
-
-                            end.div_(n)
-
-                            for b in bleeds:
-                                end += b
-                            end.div_(1 + (bleed / (1 + bleed)) * n)
-
-                            tensor[bn][xn][yn] = end
-                        else:
-                            tensor[bn][xn][yn] = nearest
-            result['samples'] = tensor.permute(0, 3, 2, 1)
+            samples = result['samples']
+            for _ in range(passes):
+                samples = self.slurry2(samples, bleed * (1 / 16))
+            result['samples'] = samples
         return (result,)
     # }}}
 
 NODE_CLASS_MAPPINGS = {
     "BSZInjectionKSampler": BSZInjectionKSampler,
+    "BSZInjectionSchedule": BSZInjectionSchedule,
     "BSZStrangeResample": BSZStrangeResample,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "BSZInjectionKSampler": "BSZ Injection KSampler",
+    "BSZInjectionSchedule": "BSZ Injection Schedule",
     "BSZStrangeResample": "BSZ Strange Resample",
 }
 
@@ -1,7 +1,16 @@
+import functools
+import hashlib
+import json
+import os
 import torch
+import weakref
 import nodes
-from math import pi
+import folder_paths
+from math import pi, cos, sin, radians
 from colorsys import hsv_to_rgb
+from os import getenv
+from threading import Lock
+from time import time
 
 XL_CONSTS = {
     "black" : [-21.675981521606445, 3.864609956741333, 2.4103028774261475, 2.579195261001587],
@@ -14,6 +23,96 @@ XL_CONSTS = {
     "yellow" : [-6.609264373779297, -10.563915252685547, 32.47910690307617, -8.209832191467285],
 }
 
+XL_RGB = {
+    "black" : (0.0, 0.0, 0.0),
+    "white" : (1.0, 1.0, 1.0),
+    "red" : (1.0, 0.0, 0.0),
+    "green" : (0.0, 1.0, 0.0),
+    "blue" : (0.0, 0.0, 1.0),
+    "cyan" : (0.0, 1.0, 1.0),
+    "magenta" : (1.0, 0.0, 1.0),
+    "yellow" : (1.0, 1.0, 0.0),
+}
+
+### Calibration {{{
+CALIBRATION_DIR = getenv(
+    'BSZ_CALIBRATION_DIR',
+    os.path.join(folder_paths.get_user_directory() if hasattr(folder_paths, "get_user_directory") else folder_paths.base_path, "bsz-latent-calibration")
+)
+# 5 levels per channel lands every XL_RGB color on the grid
+CALIBRATION_LEVELS = 5
+CALIBRATION_PATCH = 64
+
+class LatentCalibration:
+    """Mean latent value of solid colors over an RGB grid for one VAE,
+    trilinearly interpolated to produce the latent of any color without encoding"""
+    def __init__(self, grid: torch.Tensor, scale: int):
+        # [channels, r, g, b]
+        self.grid = grid
+        self.scale = scale
+
+    @property
+    def channels(self) -> int:
+        return self.grid.shape[0]
+
+    def color(self, r: float, g: float, b: float) -> list[float]:
+        # grid_sample's xyz are the last three dims backwards
+        point = torch.tensor([b, g, r], dtype=self.grid.dtype).clamp(0, 1).mul(2).sub(1).view(1, 1, 1, 1, 3)
+        return torch.nn.functional.grid_sample(self.grid[None], point, mode='bilinear', align_corners=True).flatten().tolist()
+
+    def colors(self) -> dict[str, list[float]]:
+        """Same layout as XL_CONSTS"""
+        return {name: self.color(*rgb) for name, rgb in XL_RGB.items()}
+
+    @staticmethod
+    def probe(vae) -> "LatentCalibration":
+        """Encodes one small solid patch per grid color in a single batch"""
+        levels = torch.linspace(0, 1, CALIBRATION_LEVELS)
+        rgb = torch.cartesian_prod(levels, levels, levels)
+        pixels = rgb.view(-1, 1, 1, 3).expand(-1, CALIBRATION_PATCH, CALIBRATION_PATCH, 3).contiguous()
+        samples = nodes.VAEEncode().encode(vae, pixels)[0]['samples'].detach().float().cpu()
+        grid = samples.mean(dim=(2, 3)).T.reshape(-1, CALIBRATION_LEVELS, CALIBRATION_LEVELS, CALIBRATION_LEVELS)
+        return LatentCalibration(grid.contiguous(), CALIBRATION_PATCH // samples.shape[-1])
+
+def _vae_hash(vae) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for name, tensor in sorted(vae.first_stage_model.state_dict().items()):
+        digest.update(f"{name}{tuple(tensor.shape)}{tensor.dtype}".encode())
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+calibrations = weakref.WeakKeyDictionary()
+calibration_lock = Lock()
+
+def _calibration(vae) -> LatentCalibration:
+    """Calibration for a VAE, loaded from disk by weight hash or probed and saved on first use"""
+    with calibration_lock:
+        calibration = calibrations.get(vae)
+        if calibration is not None:
+            return calibration
+        path = os.path.join(CALIBRATION_DIR, _vae_hash(vae) + ".json")
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            calibration = LatentCalibration(torch.tensor(data["grid"]), data["scale"])
+        except (OSError, ValueError, KeyError):
+            calibration = LatentCalibration.probe(vae)
+            os.makedirs(CALIBRATION_DIR, exist_ok=True)
+            # written aside then moved so a crash can't leave a half table behind
+            with open(path + ".tmp", "w") as f:
+                json.dump({"scale": calibration.scale, "grid": calibration.grid.tolist()}, f)
+            os.replace(path + ".tmp", path)
+        calibrations[vae] = calibration
+        return calibration
+
+def _colors(vae) -> dict[str, list[float]]:
+    return XL_CONSTS if vae is None else _calibration(vae).colors()
+# }}}
+
+def _channels(values: list[float], like: torch.Tensor) -> torch.Tensor:
+    """Per-channel constants as a [1, C, 1, 1] tensor that broadcasts against latents like `like`"""
+    return torch.tensor(values, dtype=like.dtype, device=like.device).view(1, -1, 1, 1)
+
 class BSZLatentDebug:
     # {{{
     @classmethod
@@ -34,16 +133,86 @@ class BSZLatentDebug:
     CATEGORY = "beinsezii/latent/advanced"
 
     def log(self, latent):
-        print("\nLatent structure:", latent)
-        samples = latent['samples']
-        print("Sample size:", list(samples.size()))
-        wh = samples.size()[-1] * samples.size()[-2]
-        for n, c in enumerate(samples[0]):
-            print(f"Tensor 0 Channel {n} Min: {c.min().item()} Max: {c.max().item()} Avg: {c.sum().item() / wh}")
+        structure = {k: f"Tensor {list(v.shape)} {v.dtype} {v.device}" if isinstance(v, torch.Tensor) else v for k, v in latent.items()}
+        print("\nLatent structure:", structure)
+        stats = _latent_stats(latent['samples'])
+        for n, item in enumerate(zip(stats['min'], stats['max'], stats['mean'], stats['std'])):
+            for c, (lo, hi, avg, std) in enumerate(zip(*item)):
+                print(f"Tensor {n} Channel {c} Min: {lo} Max: {hi} Avg: {avg} Std: {std}")
         print()
         return ()
 # }}}
 
+def _latent_stats(samples: torch.Tensor, bins: int = 0) -> dict:
+    """Per-item per-channel min/max/mean/std, and optionally histograms over the batch's range.
+    Everything is reduced on the latent's device and copied back once"""
+    batch_size, channels = samples.shape[:2]
+    flat = samples.detach().flatten(2).float()
+    lo, hi = flat.amin(dim=2), flat.amax(dim=2)
+    std, mean = torch.std_mean(flat, dim=2, correction=0)
+    results = [lo, hi, mean, std]
+    if bins > 0:
+        bounds = torch.stack([lo.min(), hi.max()])
+        index = (flat - bounds[0]).mul_(bins / (bounds[1] - bounds[0]).clamp(min=1e-12)).long().clamp_(0, bins - 1)
+        counts = torch.zeros([batch_size, channels, bins], dtype=torch.float32, device=flat.device)
+        counts.scatter_add_(2, index, torch.ones_like(flat))
+        results += [bounds, counts.flatten()]
+    results = torch.cat([r.flatten() for r in results]).cpu().tolist()
+    shape = lambda values: [values[n * channels:(n + 1) * channels] for n in range(batch_size)]
+    size = batch_size * channels
+    stats = {
+        "shape": list(samples.shape),
+        "dtype": str(samples.dtype),
+        "min": shape(results[:size]),
+        "max": shape(results[size:size * 2]),
+        "mean": shape(results[size * 2:size * 3]),
+        "std": shape(results[size * 3:size * 4]),
+    }
+    if bins > 0:
+        counts = results[size * 4 + 2:]
+        stats["histogram"] = {
+            "range": results[size * 4:size * 4 + 2],
+            "counts": shape([[int(x) for x in counts[n * bins:(n + 1) * bins]] for n in range(size)]),
+        }
+    return stats
+
+class BSZLatentStats:
+    # {{{
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "latent": ("LATENT",),
+                "bins": ("INT", {"default": 0, "min": 0, "max": 4096}),
+            },
+            "optional": {
+                "jsonl": ("STRING", {"default": ""}),
+            },
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("stats",)
+
+    FUNCTION = "stats"
+
+    OUTPUT_NODE = True
+
+    CATEGORY = "beinsezii/latent/advanced"
+
+    def stats(self, latent, bins: int, jsonl: str = ""):
+        stats = _latent_stats(latent['samples'], bins)
+        if jsonl.strip():
+            # relative to the output directory and never outside it, like ComfyUI's own save nodes
+            output = os.path.realpath(folder_paths.get_output_directory())
+            path = os.path.realpath(os.path.join(output, jsonl.strip()))
+            if os.path.commonpath((output, path)) != output:
+                raise ValueError(f"Latent stats can only be written inside the output directory '{output}', not '{path}'")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a") as f:
+                f.write(json.dumps({"time": time()} | stats) + "\n")
+        return (json.dumps(stats),)
+# }}}
+
 class BSZLatentFill:
     # {{{
     @classmethod
@@ -88,12 +257,10 @@ class BSZLatentFill:
     CATEGORY = "beinsezii/latent/advanced"
 
     def fill(self, latent, a: float, b: float, c: float, d: float):
-        samples = latent['samples'].clone();
-        for batch in samples:
-            batch[0].fill_(a)
-            batch[1].fill_(b)
-            batch[2].fill_(c)
-            batch[3].fill_(d)
+        # only the first 4 channels are filled, any others pass through
+        samples = torch.empty_like(latent['samples'])
+        samples[:, :4] = _channels([a, b, c, d], samples)
+        samples[:, 4:] = latent['samples'][:, 4:]
         return (latent | {'samples': samples},)
 # }}}
 
@@ -110,7 +277,10 @@ class BSZLatentOffsetXL:
                     "max": 1.0,
                     "step": 0.05,
                 }),
-            }
+            },
+            "optional": {
+                "vae": ("VAE",),
+            },
         }
 
     RETURN_TYPES = ("LATENT",)
@@ -122,20 +292,18 @@ class BSZLatentOffsetXL:
 
     CATEGORY = "beinsezii/latent"
 
-    def offset(self, latent, offset: float):
-        samples = latent['samples'].clone();
-        if offset > 0:
-            cols = XL_CONSTS['white']
-        elif offset < 0:
-            cols = XL_CONSTS['black']
+    def offset(self, latent, offset: float, vae=None):
+        samples = latent['samples']
+        if offset == 0:
+            return (latent,)
+        elif offset > 0:
+            cols = _colors(vae)['white']
+        else:
+            cols = _colors(vae)['black']
             offset = abs(offset)
-        for batch in samples:
-            if offset != 0:
-                batch.mul_(1 - offset)
-                batch[0].add_(cols[0] * offset)
-                batch[1].add_(cols[1] * offset)
-                batch[2].add_(cols[2] * offset)
-                batch[3].add_(cols[3] * offset)
+        # the whole latent is scaled, but the constants only cover as many channels as there are colors
+        samples = samples.mul(1 - offset)
+        samples[:, :len(cols)] += _channels([col * offset for col in cols], samples)
         return (latent | {'samples': samples},)
 # }}}
 
@@ -149,20 +317,23 @@ class BSZColoredLatentImageXL:
             "width": ("INT", {"default": 1024, "min": 16, "max": nodes.MAX_RESOLUTION, "step": 8}),
             "height": ("INT", {"default": 1024, "min": 16, "max": nodes.MAX_RESOLUTION, "step": 8}),
             "batch_size": ("INT", {"default": 1, "min": 1, "max": 4096}),
+        },
+        "optional": {
+            "expand": ("BOOLEAN", {"default": False}),
+            "vae": ("VAE",),
         }}
     RETURN_TYPES = ("LATENT",)
     FUNCTION = "generate"
 
     CATEGORY = "beinsezii/latent"
 
-    def generate(self, color: str, strength: float, width: int, height: int, batch_size: int):
-        samples = torch.empty([batch_size, 4, height // 8, width // 8])
-        cols = XL_CONSTS[color]
-        for batch in samples:
-            batch[0].fill_(cols[0] * strength)
-            batch[1].fill_(cols[1] * strength)
-            batch[2].fill_(cols[2] * strength)
-            batch[3].fill_(cols[3] * strength)
+    def generate(self, color: str, strength: float, width: int, height: int, batch_size: int, expand: bool = False, vae=None):
+        scale = 8 if vae is None else _calibration(vae).scale
+        cols = torch.tensor([col * strength for col in _colors(vae)[color]]).view(1, -1, 1, 1)
+        # every item and pixel share the same values, so expanding costs nothing until something writes to it
+        samples = cols.expand([batch_size, cols.shape[1], height // scale, width // scale])
+        if not expand:
+            samples = samples.contiguous()
         return ({"samples":samples},)
     # }}}
 
@@ -186,18 +357,12 @@ class BSZLatentRGBAImage:
     CATEGORY = "beinsezii/latent"
 
     def generate(self, vae, r: float, g: float, b: float, a: float, width: int, height: int, batch_size: int):
+        calibration = _calibration(vae)
+        shape = [batch_size, calibration.channels, height // calibration.scale, width // calibration.scale]
         if a < 0.01:
-            return ({'samples': torch.zeros([batch_size, 4, height // 8, width // 8])},)
-        pixels = torch.empty([1, height, width, 3])
-        view = pixels.permute(0, 3, 1, 2)
-        view[0][0].fill_(r)
-        view[0][1].fill_(g)
-        view[0][2].fill_(b)
-        del view
-        encoder = nodes.VAEEncode()
-        latent = encoder.encode(vae, pixels)[0]
-        latent['samples'] = latent['samples'].mul(a).expand([batch_size, 4, height // 8, width // 8])
-        return (latent,)
+            return ({'samples': torch.zeros(shape)},)
+        cols = torch.tensor(calibration.color(r, g, b)).mul(a).view(1, -1, 1, 1)
+        return ({'samples': cols.expand(shape)},)
     # }}}
 
 class BSZLatentHSVAImage:
@@ -224,6 +389,42 @@ class BSZLatentHSVAImage:
         return BSZLatentRGBAImage.generate(self, vae, r, g, b, a, width, height, batch_size)
     # }}}
 
+@functools.lru_cache(maxsize=16)
+def _gradient_factor(
+    height: int, width: int, pattern: str, xfrequency: float, yfrequency: float, xoffset: float, yoffset: float
+) -> torch.Tensor:
+    """[height, width] blend factor shared by every batch item and channel.
+    Cached, so treat the result as read only"""
+    # both run from 1 down to 0
+    xnorm = torch.linspace(1, 0, width).view(1, width)
+    ynorm = torch.linspace(1, 0, height).view(height, 1)
+
+    if pattern == "sine" or pattern == "sine2":
+        factor = ynorm.add(yoffset).mul(yfrequency) if pattern == "sine" else ynorm.mul(-1).add(1+yoffset).mul(yfrequency)
+        factor = factor + xnorm.add(xoffset).mul(xfrequency)
+        factor.div_(2 - abs(xfrequency / 10 - yfrequency / 10))
+        factor.mul_(pi)
+        factor.cos_()
+        factor.add_(1)
+        factor.div_(2)
+    elif pattern == "circle":
+        factor = xnorm.add(xoffset).mul(pi).mul(xfrequency).sin()
+        factor = factor + ynorm.add(yoffset).mul(pi).mul(yfrequency).sin()
+        factor.div_(2)
+        factor.abs_()
+    elif pattern == "squircle":
+        factor = xnorm.add(xoffset).mul(pi).mul(xfrequency).sin()
+        factor = factor * ynorm.add(yoffset).mul(pi).mul(yfrequency).sin()
+        factor.abs_()
+    elif pattern == "rings":
+        factor = xnorm.add(xoffset).mul(pi).sin().mul(xfrequency)
+        factor = factor + ynorm.add(yoffset).mul(pi).sin().mul(yfrequency)
+        factor.sin_()
+        factor.abs_()
+    else:
+        raise ValueError("Invalid gradient pattern!")
+    return factor
+
 class BSZLatentGradient:
     # {{{
     @classmethod
@@ -289,57 +490,88 @@ class BSZLatentGradient:
     ):
         if a['samples'].shape != b['samples'].shape:
             raise ValueError(f"Latents must have equivalent shapes!\nA: {a['samples'].shape}\nB: {b['samples'].shape}")
-        aamples = a['samples'].clone();
-        bamples = b['samples'].clone();
-        smallest = min(len(aamples), len(bamples))
-        batch, channels, height, width = aamples.shape
-
-        xnorm = lambda: torch.tensor([n / (width-1) for n in reversed(range(width))]).expand([channels, height, width]).clone()
-        ynorm = lambda: torch.tensor([n / (height-1) for n in reversed(range(height))]).expand([channels, width, height]).swapaxes(1, 2).clone()
-
-        if pattern == "sine" or pattern == "sine2":
-            factor = ynorm().add(yoffset).mul(yfrequency) if pattern == "sine" else ynorm().mul(-1).add(1+yoffset).mul(yfrequency)
-            factor += xnorm().add(xoffset).mul(xfrequency)
-            factor.div_(2 - abs(xfrequency / 10 - yfrequency / 10))
-            factor.mul_(pi)
-            factor.cos_()
-            factor.add_(1)
-            factor.div_(2)
-        elif pattern == "circle":
-            factor = xnorm().add(xoffset).mul(pi).mul(xfrequency).sin()
-            factor += ynorm().add(yoffset).mul(pi).mul(yfrequency).sin()
-            factor.div_(2)
-            factor.abs_()
-        elif pattern == "squircle":
-            factor = xnorm().add(xoffset).mul(pi).mul(xfrequency).sin()
-            factor *= ynorm().add(yoffset).mul(pi).mul(yfrequency).sin()
-            factor.abs_()
-        elif pattern == "rings":
-            factor = xnorm().add(xoffset).mul(pi).sin().mul(xfrequency)
-            factor += ynorm().add(yoffset).mul(pi).sin().mul(yfrequency)
-            factor.sin_()
-            factor.abs_()
+        aamples, bamples = a['samples'], b['samples']
+        factor = _gradient_factor(aamples.shape[-2], aamples.shape[-1], pattern, xfrequency, yfrequency, xoffset, yoffset)
+        factor = factor.to(aamples.device, aamples.dtype)
+        # a * (1 - f) + b * f broadcast over every batch and channel at once
+        if invert:
+            samples = torch.lerp(bamples, aamples, factor)
         else:
-            raise ValueError("Invalid gradient pattern!")
-
-        for na, nb in zip(aamples, bamples):
-            batchfac = factor.clone()
-            if invert:
-                na *= batchfac
-                batchfac.mul_(-1)
-                batchfac.add_(1)
-                nb *= batchfac
-            else:
-                nb *= batchfac
-                batchfac.mul_(-1)
-                batchfac.add_(1)
-                na *= batchfac
-            na += nb
-            del batchfac
-
-        return (a | {'samples': aamples},)
+            samples = torch.lerp(aamples, bamples, factor)
+        return (a | {'samples': samples},)
 # }}}
 
+# Black and white for channels 0 and 3, then the neutral point and spread of channels 1 and 2
+# Channels 1 and 2 are approx values due to lack of forward plot
+HUECHROMA_XL = (
+    -21.675973892211914, 18.038631439208984,
+    2.5792038440704346, -8.136277198791504,
+    4.560664176940918, abs(-11.767170906066895) + 4.560664176940918,
+    3.3889966011047363, 18.39630699157715 + 3.3889966011047363,
+)
+
+def _huechroma_consts(vae) -> tuple[float, ...]:
+    if vae is None:
+        return HUECHROMA_XL
+    calibration = _calibration(vae)
+    if calibration.channels != 4:
+        raise ValueError(f"Hue/Chroma needs a 4 channel VAE, this one has {calibration.channels}")
+    black, white, gray = calibration.color(0, 0, 0), calibration.color(1, 1, 1), calibration.color(0.5, 0.5, 0.5)
+    return (
+        black[0], white[0],
+        black[3], white[3],
+        # spreads are built the same way as the hand-measured XL ones above, so the SDXL VAE reproduces them
+        gray[1], abs(calibration.grid[1].min().item()) + gray[1],
+        gray[2], calibration.grid[2].max().item() + gray[2],
+    )
+
+HUECHROMA_CHUNK = 1 << 18
+
+def _huechroma_kernel(pixels: torch.Tensor, params: torch.Tensor) -> tuple[torch.Tensor, ...]:
+    """Lightness and hue/chroma shift of [4, N] latent pixels in one pass.
+    params are cos/sin of the hue shift, chroma, lightness, then each channel's offset and scale"""
+    cos_h, sin_h, chroma, lightness, l_black, l_scale, a_black, a_scale, b_center, b_scale, c_center, c_scale = params.unbind()
+    l, b, c, a = pixels.unbind()
+    # Lightness
+    # unscale -> shift -> rescale collapses into a single add per channel
+    alphas = ((l - l_black) * l_scale + (a - a_black) * a_scale).div(100).square().div(2).clamp(0.0, 1.0)
+    l = l + lightness * (1 - alphas) / l_scale
+    a = a + lightness * alphas / a_scale
+    # Hue/Chroma
+    # rotating the unit vector instead of atan2 -> cos/sin round trips
+    b = (b - b_center) * b_scale
+    c = (c - c_center) * c_scale
+    radius = torch.hypot(b, c)
+    zero = radius == 0
+    safe = torch.where(zero, 1.0, radius)
+    b_unit = torch.where(zero, 1.0, b / safe)
+    c_unit = c / safe
+    radius = radius + chroma
+    b = radius * (b_unit * cos_h - c_unit * sin_h) / b_scale + b_center
+    c = radius * (c_unit * cos_h + b_unit * sin_h) / c_scale + c_center
+    return l, b, c, a
+
+huechroma_compiled = None
+
+def _huechroma_compiled():
+    """_huechroma_kernel through torch.compile when BSZ_TORCH_COMPILE is set,
+    falling back to eager for good if compilation fails"""
+    global huechroma_compiled
+    if huechroma_compiled is None:
+        huechroma_compiled = _huechroma_kernel
+        if getenv('BSZ_TORCH_COMPILE', False) and hasattr(torch, "compile"):
+            compiled = torch.compile(_huechroma_kernel, dynamic=True)
+            def kernel(pixels, params):
+                global huechroma_compiled
+                try:
+                    return compiled(pixels, params)
+                except Exception as e:
+                    print(f"BSZHueChromaXL: torch.compile failed, using eager kernel\n{e}")
+                    huechroma_compiled = _huechroma_kernel
+                    return _huechroma_kernel(pixels, params)
+            huechroma_compiled = kernel
+    return huechroma_compiled
+
 class BSZHueChromaXL:
     # {{{
     @classmethod
@@ -363,6 +595,9 @@ class BSZHueChromaXL:
                     "max": 100.0,
                 }),
             },
+            "optional": {
+                "vae": ("VAE",),
+            },
         }
 
     RETURN_TYPES = ("LATENT",)
@@ -374,59 +609,36 @@ class BSZHueChromaXL:
 
     CATEGORY = "beinsezii/latent"
 
-    def latent_huechroma(self, latent, hue, chroma, lightness):
+    def latent_huechroma(self, latent, hue, chroma, lightness, vae=None):
         if hue == 0 and chroma == 0 and lightness == 0:
             return (latent,)
-        latent = latent.copy()
-        samples = latent['samples'].clone().permute(1,0,2,3)
-        # Lightness
-        samples[0] -= -21.675973892211914
-        samples[0] *= 100 / (abs(-21.675973892211914) + 18.038631439208984)
-
-        samples[3] -= 2.5792038440704346
-        samples[3] *= -100 / (abs(-8.136277198791504) + 2.5792038440704346)
-
-        alphas = (samples[0] + samples[3]) / 2
-        alphas /= 50
-        alphas **= 2
-        alphas /= 2
-        alphas = alphas.clip(0.0, 1.0)
-        betas = 1 - alphas
-
-        samples[0] += lightness * betas
-        samples[3] += lightness * alphas
-
-        samples[0] /= 100 / (abs(-21.675973892211914) + 18.038631439208984)
-        samples[0] += -21.675973892211914
-        samples[3] /= -100 / (abs(-8.136277198791504) + 2.5792038440704346)
-        samples[3] += 2.5792038440704346
-
-        # Hue/Chroma
-        # Approx values due to lack of forward plot
-        samples[1] -= 4.560664176940918
-        samples[1] *= -100 / (abs(-11.767170906066895) + 4.560664176940918)
-        samples[2] -= 3.3889966011047363
-        samples[2] *= 100 / (18.39630699157715 + 3.3889966011047363)
-        chroma_arr = (samples[1] ** 2 + samples[2] ** 2).sqrt()
-        hue_arr = samples[2].atan2(samples[1]).rad2deg()
-
-        chroma_arr += chroma
-        hue_arr += hue
-
-        samples[1] = chroma_arr * hue_arr.deg2rad().cos()
-        samples[2] = chroma_arr * hue_arr.deg2rad().sin()
-
-        samples[1] /= -100 / (abs(-11.767170906066895) + 4.560664176940918)
-        samples[1] += 4.560664176940918
-        samples[2] /= 100 / (18.39630699157715 + 3.3889966011047363)
-        samples[2] += 3.3889966011047363
-
-        latent['samples'] = samples.permute(1,0,2,3)
-        return (latent,)
+        l_black, l_white, a_black, a_white, b_center, b_span, c_center, c_span = _huechroma_consts(vae)
+        samples = latent['samples']
+        # reduced precision latents are only upcast a chunk at a time
+        dtype = samples.dtype if samples.dtype in [torch.float32, torch.float64] else torch.float32
+        params = torch.tensor([
+            cos(radians(hue)), sin(radians(hue)), chroma, lightness,
+            l_black, 100 / (l_white - l_black),
+            a_black, 100 / (a_white - a_black),
+            b_center, -100 / b_span,
+            c_center, 100 / c_span,
+        ], dtype=dtype, device=samples.device)
+        kernel = _huechroma_compiled()
+        result = torch.empty_like(samples, memory_format=torch.contiguous_format)
+        for source, target in zip(samples, result):
+            # only the first 4 channels are transformed, any others pass through
+            target[4:].copy_(source[4:])
+            source, target = source[:4].reshape(4, -1), target[:4].view(4, -1)
+            for start in range(0, source.shape[1], HUECHROMA_CHUNK):
+                chunk = slice(start, start + HUECHROMA_CHUNK)
+                for channel, values in zip(target[:, chunk], kernel(source[:, chunk].to(dtype), params)):
+                    channel.copy_(values)
+        return (latent | {'samples': result},)
     # }}}
 
 NODE_CLASS_MAPPINGS = {
     "BSZLatentDebug": BSZLatentDebug,
+    "BSZLatentStats": BSZLatentStats,
     "BSZLatentFill": BSZLatentFill,
     "BSZLatentOffsetXL": BSZLatentOffsetXL,
     "BSZColoredLatentImageXL": BSZColoredLatentImageXL,
@@ -438,6 +650,7 @@ NODE_CLASS_MAPPINGS = {
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "BSZLatentDebug": "BSZ Latent Debug",
+    "BSZLatentStats": "BSZ Latent Stats",
     "BSZLatentFill": "BSZ Latent Fill",
     "BSZLatentOffsetXL": "BSZ Latent Offset XL",
     "BSZColoredLatentImageXL": "BSZ Colored Latent Image XL",
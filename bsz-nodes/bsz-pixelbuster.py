@@ -2,8 +2,16 @@
 # -*- coding: utf-8 -*-
 import os.path
 import ctypes
+import functools
+import hashlib
+import re
 import numpy
+import torch
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count, getenv
 from sys import platform
+from threading import Lock
 
 if platform == "win32":
     LIBRARY = "pixelbuster.dll"
@@ -12,26 +20,536 @@ elif platform == "darwin":
 elif platform == "linux":
     LIBRARY = "libpixelbuster.so"
 
+# Loaded on first execution so a missing library doesn't cost or break anything until it's actually needed
 pb_lib = None
-try:
-    pb_lib = ctypes.CDLL(os.path.join(os.path.dirname(os.path.realpath(__file__)), LIBRARY))
-    pb_lib.pb_help_ffi.restype = ctypes.c_char_p
+pb_error = None
+pb_lock = Lock()
 
-    pb_lib.pixelbuster_ffi.argtypes = [
-        ctypes.c_char_p, ctypes.c_char_p, numpy.ctypeslib.ndpointer(ndim=1, flags=('W', 'C', 'A')), ctypes.c_uint, ctypes.c_uint
-    ]
+def _library(required: bool = False):
+    """The pixelbuster library with its argtypes bound, or None if it can't be loaded.
+    With required it raises instead of returning None"""
+    global pb_lib, pb_error
+    if pb_lib is None and pb_error is None:
+        with pb_lock:
+            if pb_lib is None and pb_error is None:
+                try:
+                    lib = ctypes.CDLL(os.path.join(os.path.dirname(os.path.realpath(__file__)), LIBRARY))
+                    lib.pb_help_ffi.restype = ctypes.c_char_p
+
+                    lib.pixelbuster_ffi.argtypes = [
+                        ctypes.c_char_p, ctypes.c_char_p, numpy.ctypeslib.ndpointer(ndim=1, flags=('W', 'C', 'A')), ctypes.c_uint, ctypes.c_uint
+                    ]
+
+                    lib.pixelbuster_ffi_ext.argtypes = [
+                        ctypes.c_char_p, ctypes.c_char_p, numpy.ctypeslib.ndpointer(ndim=1, flags=('W', 'C', 'A')), ctypes.c_uint, ctypes.c_uint,
+                        ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float
+                    ]
+                    pb_lib = lib
+                except Exception as e:
+                    pb_error = e
+    if pb_lib is None and required:
+        raise RuntimeError(
+            f"Could not load pixelbuster library '{LIBRARY}' for platform '{platform}'\n"
+            "Consider downloading the appropriate pixelbuster library for your platform from\n"
+            f"https://github.com/Beinsezii/pixelbuster\n{pb_error}"
+        )
+    return pb_lib
+
+@functools.cache
+def _help() -> str:
+    lib = _library()
+    if lib is None:
+        return f"Pixelbuster library '{LIBRARY}' could not be loaded, so its help is unavailable.\n{pb_error}"
+    return lib.pb_help_ffi().decode('UTF-8')
+
+# 0 or unset picks the core count
+THREADS = int(getenv('BSZ_PB_THREADS', 0)) or cpu_count() or 1
+
+def _threaded(fn, jobs: int, threads: int):
+    """Calls fn(worker, job) for every job in range(jobs) across a thread pool.
+    Each worker index only ever runs on one thread, so per-worker buffers are safe.
+    ctypes releases the GIL for the duration of the library call"""
+    threads = max(1, min(threads or THREADS, jobs))
+    if threads == 1:
+        for job in range(jobs):
+            fn(0, job)
+        return
+    def worker(w):
+        for job in range(w, jobs, threads):
+            fn(w, job)
+    with ThreadPoolExecutor(threads) as pool:
+        for future in [pool.submit(worker, w) for w in range(threads)]:
+            future.result()
+
+# pixelbuster derives a pixel's row from its offset into the buffer, so these can't be split into strips
+VERTICAL_TOKENS = {"row", "ynorm", "height"}
+
+def _lines(code: str) -> list[str]:
+    """Statements the way the library reads them: ';' breaks lines anywhere,
+    lines starting with '#' are dropped, then lines ending in a backslash are joined with the next"""
+    lines = []
+    continued = False
+    for line in code.replace(';', '\n').splitlines():
+        if line.strip().startswith('#'):
+            continue
+        if continued:
+            lines[-1] = lines[-1][:-1] + ' ' + line
+        else:
+            lines.append(line)
+        continued = line.rstrip().endswith('\\')
+        if continued:
+            lines[-1] = lines[-1].rstrip()
+    return [line for line in lines if line.strip()]
+
+class Program:
+    """Pixelbuster code prepared once for repeated runs.
+    The library only exposes a parse-and-run entry point, so preparing means
+    pre-encoding the code and noting which tokens it references"""
+    def __init__(self, code: str, space: str):
+        self.code = code.encode('UTF-8')
+        self.space = space.encode('UTF-8')
+        self.tokens = set(re.findall(r'\w+', '\n'.join(_lines(code)).lower()))
+
+    def uses(self, tokens: set[str]) -> bool:
+        """Whether the code references one of the tokens"""
+        return not self.tokens.isdisjoint(tokens)
+
+    def run(self, buff: numpy.ndarray, width: int, externals: list[float]):
+        """Runs over a flat, C-contiguous float32 RGBA buffer in place"""
+        _library(True).pixelbuster_ffi_ext(self.code, self.space, buff, buff.nbytes, width, *externals)
+
+@functools.lru_cache(maxsize=64)
+def _compile(code: str, space: str) -> Program:
+    return Program(code, space)
+
+def _run_native(image, program: Program, externals: list[list[float]], threads: int, strips: int):
+    """Runs a native program over a [batch, height, width, channels] image in row strips across threads,
+    returning a new float32 tensor"""
+    image = image.cpu()
+    batch_size, height, width, channels = image.shape
+    # written into a fresh tensor instead of cloning so the comfyui cache never gets polluted
+    result = torch.empty([batch_size, height, width, channels], dtype=torch.float32)
+    # Full width row strips keep col/xnorm/width intact, but row/ynorm/height would become strip local
+    if program.uses(VERTICAL_TOKENS):
+        strips = 1
+    elif strips == 0:
+        # only split frames when there aren't enough of them to go around
+        strips = -(-(threads or THREADS) // batch_size)
+    rows = -(-height // max(1, min(strips, height)))
+    strips = -(-height // rows)
+    # pixelbuster only takes 4 channel pixels, so each worker reuses one RGBA working buffer for its strips
+    scratches = {}
+    src, dst = image.numpy(), result.numpy()
+    def run(worker, job):
+        n, strip = divmod(job, strips)
+        top, bottom = strip * rows, min(strip * rows + rows, height)
+        scratch = scratches.get(worker)
+        if scratch is None:
+            scratch = scratches[worker] = numpy.empty([rows, width, 4], dtype=numpy.float32)
+        scratch = scratch[:bottom - top]
+        scratch[:, :, :channels] = src[n, top:bottom]
+        scratch[:, :, channels:] = 1
+        program.run(scratch.reshape(-1), width, externals[n])
+        dst[n, top:bottom] = scratch[:, :, :channels]
+    _threaded(run, batch_size * strips, threads)
+    return result
+
+### Torch backend {{{
+
+# Conversions are a straight chain, so moving between two spaces walks every step in between.
+# Constants match the pixelbuster library so both backends agree to float precision
+SPACE_CHAIN = ["hsv", "srgb", "lrgb", "xyz", "lab", "lch"]
+SPACE_ALIASES = {"rgb": "lrgb"}
+SPACE_CHANNELS = {"hsv": "hsva", "srgb": "rgba", "lrgb": "rgba", "xyz": "xyza", "lab": "lab", "lch": "lcha"}
+XYZ_MATRIX = [[0.4124, 0.3576, 0.1805], [0.2126, 0.7152, 0.0722], [0.0193, 0.1192, 0.9505]]
+XYZ_MATRIX_INV = [[3.2406, -1.5372, -0.4986], [-0.9689, 1.8758, 0.0415], [0.0557, -0.2040, 1.0570]]
+LAB_WHITE = [0.950489, 1.0, 1.08884]
+LAB_EPSILON = 216 / 24389
+LAB_KAPPA = 24389 / 27
+
+def _srgb_to_hsv(r, g, b):
+    # fmax/fmin skip NaN channels like the library's f32::max/min instead of propagating them
+    v = torch.fmax(torch.fmax(r, g), b)
+    delta = v - torch.fmin(torch.fmin(r, g), b)
+    s = torch.where(delta == 0, 0, delta / v)
+    rc, gc, bc = (v - r) / delta, (v - g) / delta, (v - b) / delta
+    h = torch.where(r == v, bc - gc, torch.where(g == v, 2 + rc - bc, 4 + gc - rc))
+    h = torch.where(delta == 0, 0, torch.remainder(h / 6, 1))
+    return h, s, v
+
+def _hsv_to_srgb(h, s, v):
+    i = torch.trunc(h * 6)
+    f = h * 6 - i
+    p, q, t = v * (1 - s), v * (1 - s * f), v * (1 - s * (1 - f))
+    # sectors outside of 0 -> 5 fall through to the last one, same as the library
+    r = torch.where(i == 0, v, torch.where(i == 1, q, torch.where(i == 2, p, torch.where(i == 3, p, torch.where(i == 4, t, v)))))
+    g = torch.where(i == 0, t, torch.where(i == 1, v, torch.where(i == 2, v, torch.where(i == 3, q, torch.where(i == 4, p, p)))))
+    b = torch.where(i == 0, p, torch.where(i == 1, p, torch.where(i == 2, t, torch.where(i == 3, v, torch.where(i == 4, v, q)))))
+    return r, g, b
+
+def _srgb_to_lrgb(*pixel):
+    return [torch.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4) for c in pixel]
+
+def _lrgb_to_srgb(*pixel):
+    return [torch.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1 / 2.4) - 0.055) for c in pixel]
+
+def _matmul(matrix, pixel):
+    return [row[0] * pixel[0] + row[1] * pixel[1] + row[2] * pixel[2] for row in matrix]
 
-    pb_lib.pixelbuster_ffi_ext.argtypes = [
-        ctypes.c_char_p, ctypes.c_char_p, numpy.ctypeslib.ndpointer(ndim=1, flags=('W', 'C', 'A')), ctypes.c_uint, ctypes.c_uint,
-        ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float, ctypes.c_float
+def _xyz_to_lab(x, y, z):
+    fx, fy, fz = [
+        torch.where(c > LAB_EPSILON, c ** (1 / 3), (LAB_KAPPA * c + 16) / 116)
+        for c in [x / LAB_WHITE[0], y / LAB_WHITE[1], z / LAB_WHITE[2]]
     ]
-except Exception as e:
-    print(f"\nbsz-cui-extras: Could not load pixelbuster library '{LIBRARY}' for platform '{platform}'")
-    print("bsz-cui-extras: Consider downloading the appropriate pixelbuster library for your platform from")
-    print("bsz-cui-extras: https://github.com/Beinsezii/pixelbuster")
-    raise e
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+def _lab_to_xyz(l, a, b):
+    fy = (l + 16) / 116
+    fx, fz = a / 500 + fy, fy - b / 200
+    x = torch.where(fx ** 3 > LAB_EPSILON, fx ** 3, (116 * fx - 16) / LAB_KAPPA)
+    y = torch.where(l > LAB_KAPPA * LAB_EPSILON, fy ** 3, l / LAB_KAPPA)
+    z = torch.where(fz ** 3 > LAB_EPSILON, fz ** 3, (116 * fz - 16) / LAB_KAPPA)
+    return x * LAB_WHITE[0], y * LAB_WHITE[1], z * LAB_WHITE[2]
+
+def _lab_to_lch(l, a, b):
+    # squared and summed like the library rather than hypot, so huge values overflow the same way
+    return l, (a * a + b * b).sqrt(), torch.remainder(torch.atan2(b, a).rad2deg(), 360)
+
+def _lch_to_lab(l, c, h):
+    h = h.deg2rad()
+    return l, c * h.cos(), c * h.sin()
+
+# (forward, backward) between each link of SPACE_CHAIN
+SPACE_STEPS = [
+    (_hsv_to_srgb, _srgb_to_hsv),
+    (_srgb_to_lrgb, _lrgb_to_srgb),
+    (lambda *p: _matmul(XYZ_MATRIX, p), lambda *p: _matmul(XYZ_MATRIX_INV, p)),
+    (_xyz_to_lab, _lab_to_xyz),
+    (_lab_to_lch, _lch_to_lab),
+]
+
+def _convert(pixel: list, start: str, end: str) -> list:
+    a, b = SPACE_CHAIN.index(start), SPACE_CHAIN.index(end)
+    for n in range(a, b):
+        pixel = list(SPACE_STEPS[n][0](*pixel))
+    for n in reversed(range(b, a)):
+        pixel = list(SPACE_STEPS[n][1](*pixel))
+    return pixel
+
+def _round(x):
+    # rust rounds half away from zero
+    return torch.copysign(torch.floor(x.abs() + 0.5), x)
+
+def _signum(x):
+    return torch.where(x.isnan(), x, torch.where(x.signbit(), -1.0, 1.0))
+
+def _div_euclid(a, b):
+    q = torch.trunc(a / b)
+    return torch.where(torch.fmod(a, b) < 0, torch.where(b > 0, q - 1, q + 1), q)
+
+def _rem_euclid(a, b):
+    r = torch.fmod(a, b)
+    return torch.where(r < 0, r + b.abs(), r)
+
+# target = op(target, source)
+BINARY_OPS = {
+    ("+=", "+", "add"): torch.add,
+    ("-=", "-", "sub"): torch.sub,
+    ("*=", "*", "mul"): torch.mul,
+    ("/=", "/", "div"): torch.div,
+    ("%=", "%", "mod"): torch.fmod,
+    ("**", "^", "pow"): torch.pow,
+    ("=", "set"): lambda a, b: b,
+    ("atan2",): torch.atan2,
+    ("copysign",): torch.copysign,
+    ("diveuclid",): _div_euclid,
+    ("hypot",): torch.hypot,
+    ("log",): lambda a, b: a.log() / b.log(),
+    ("max",): torch.fmax,
+    ("min",): torch.fmin,
+    ("remeuclid",): _rem_euclid,
+    ("invert",): lambda a, b: b - a,
+}
+# target = op(source)
+UNARY_OPS = {
+    "abs": torch.abs, "acos": torch.acos, "acosh": torch.acosh, "asin": torch.asin, "asinh": torch.asinh,
+    "atan": torch.atan, "atanh": torch.atanh, "cbrt": lambda x: x.abs() ** (1 / 3) * x.sign(), "ceil": torch.ceil,
+    "cos": torch.cos, "cosh": torch.cosh, "degrees": torch.rad2deg, "exp": torch.exp, "exp2": torch.exp2,
+    "expm1": torch.expm1, "floor": torch.floor, "fract": lambda x: x - x.trunc(), "ln": torch.log,
+    "ln1p": torch.log1p, "log10": torch.log10, "log2": torch.log2, "radians": torch.deg2rad,
+    "recip": torch.reciprocal, "round": _round, "signum": _signum, "sin": torch.sin, "sinh": torch.sinh,
+    "sqrt": torch.sqrt, "tan": torch.tan, "tanh": torch.tanh, "trunc": torch.trunc,
+}
+OPS = {name: (True, fn) for names, fn in BINARY_OPS.items() for name in names} | {name: (False, fn) for name, fn in UNARY_OPS.items()}
+COMPARISONS = {
+    "==": torch.eq, "eq": torch.eq,
+    "!=": torch.ne, "!": torch.ne, "neq": torch.ne,
+    ">": torch.gt, "gt": torch.gt,
+    "<": torch.lt, "lt": torch.lt,
+    ">=": torch.ge, "gteq": torch.ge,
+    "<=": torch.le, "lteq": torch.le,
+}
+VARIABLES = [f"{p}{n}" for p in "ve" for n in range(1, 10)]
+SOURCES = {"pi", "e", "rand", "col", "row", "width", "height", "xnorm", "ynorm"}
+
+class TorchProgram:
+    """Pixelbuster code translated into batched torch operations.
+    Runs on whatever device the pixels live on and can see any part of a frame with its global coordinates.
+    Invalid lines are skipped like the library does, but jumps, labels and conditional space changes
+    have no vectorized equivalent so code using them raises ValueError on construction"""
+    def __init__(self, code: str, space: str):
+        self.space = self.start = SPACE_ALIASES.get(space, space)
+        self.lines = []
+        for line in _lines(code.lower()):
+            try:
+                self.lines.append(self._parse(line.split(), []))
+            except KeyError:
+                pass
+        if self.space != self.start:
+            self.lines.append(("space", self.space, self.start))
+
+    def _target(self, name: str):
+        if name in VARIABLES:
+            return name
+        if name in ["c1", "c2", "c3", "c4"]:
+            return int(name[1]) - 1
+        if name in SPACE_CHANNELS[self.space]:
+            return SPACE_CHANNELS[self.space].index(name)
+        raise KeyError(name)
+
+    def _source(self, name: str):
+        if name in SOURCES:
+            return name
+        try:
+            return float(name)
+        except ValueError:
+            return self._target(name)
+
+    def _parse(self, line: list[str], conditions: list):
+        if line[0] in ["jmp", "goto"] or line[0].startswith(':'):
+            raise ValueError(f"Jumps can't be vectorized: '{' '.join(line)}'")
+        elif line[0] == "if" and len(line) > 4 and line[2] in COMPARISONS:
+            condition = (self._source(line[1]), COMPARISONS[line[2]], self._source(line[3]))
+            return self._parse(line[4:], conditions + [condition])
+        elif len(line) == 1 and SPACE_ALIASES.get(line[0], line[0]) in SPACE_CHAIN:
+            if conditions:
+                raise ValueError(f"Conditional space changes can't be vectorized: '{' '.join(line)}'")
+            space, self.space = self.space, SPACE_ALIASES.get(line[0], line[0])
+            return ("space", space, self.space)
+        elif len(line) == 3 and line[0] == "swap":
+            return ("swap", self._target(line[1]), self._target(line[2]), conditions)
+        elif len(line) == 3 and line[1] in OPS:
+            return ("op", self._target(line[0]), OPS[line[1]], self._source(line[2]), conditions)
+        raise KeyError(line[0])
+
+    def run(self, pixels: list, externals: torch.Tensor, x: torch.Tensor, y: torch.Tensor, width: int, height: int) -> list:
+        """Runs over a list of 4 channel tensors, each broadcastable to [B, H, W].
+        externals is [B or 1, 9], x is the global column of every pixel as [W] and y the global row as [H].
+        Returns the 4 resulting channels without modifying the inputs"""
+        pixels = list(pixels)
+        shape = torch.broadcast_shapes(*[p.shape for p in pixels], (externals.shape[0], len(y), len(x)))
+        dtype, device = pixels[0].dtype, pixels[0].device
+        values = {v: torch.zeros((), dtype=dtype, device=device) for v in VARIABLES}
+        values |= {f"e{n+1}": e.to(dtype).view(-1, 1, 1) for n, e in enumerate(externals.to(device).T)}
+        x, y = x.to(device, dtype).view(1, 1, -1), y.to(device, dtype).view(1, -1, 1)
+        constants = {
+            "pi": torch.tensor(numpy.pi, dtype=dtype, device=device), "e": torch.tensor(numpy.e, dtype=dtype, device=device),
+            "col": x, "row": y, "width": torch.tensor(width, dtype=dtype, device=device),
+            "height": torch.tensor(height, dtype=dtype, device=device), "xnorm": x / width, "ynorm": y / height,
+        }
+
+        def get(source):
+            if isinstance(source, int):
+                return pixels[source]
+            elif isinstance(source, float):
+                return torch.tensor(source, dtype=dtype, device=device)
+            elif source == "rand":
+                return torch.rand(shape, dtype=dtype, device=device)
+            elif source in constants:
+                return constants[source]
+            return values[source]
 
-HELP = pb_lib.pb_help_ffi().decode('UTF-8')
+        def put(target, value, mask):
+            if mask is not None:
+                value = torch.where(mask, value, get(target))
+            if isinstance(target, int):
+                pixels[target] = value
+            else:
+                values[target] = value
+
+        for line in self.lines:
+            if line[0] == "space":
+                pixels[:3] = _convert(pixels[:3], line[1], line[2])
+                continue
+            mask = None
+            for a, comparison, b in line[-1]:
+                condition = comparison(get(a), get(b))
+                mask = condition if mask is None else mask & condition
+            if line[0] == "swap":
+                a, b = get(line[1]), get(line[2])
+                put(line[1], b, mask)
+                put(line[2], a, mask)
+            else:
+                (binary, fn), target = line[2], line[1]
+                put(target, fn(get(target), get(line[3])) if binary else fn(get(line[3])), mask)
+        return [torch.broadcast_to(p, shape) for p in pixels]
+
+@functools.lru_cache(maxsize=64)
+def _torch_compile(code: str, space: str) -> TorchProgram | None:
+    """None if the code can't be vectorized"""
+    try:
+        return TorchProgram(code, space)
+    except ValueError:
+        return None
+
+# }}}
+
+# auto runs cpu tensors through the native library when it's available and everything else through torch
+BACKEND = getenv('BSZ_PB_BACKEND', 'auto')
+
+def _torch_program(code: str, space: str, device: torch.device) -> TorchProgram | None:
+    """The torch program to run instead of the native library, if any.
+    The library is only loaded when the choice depends on it"""
+    if BACKEND == "native":
+        _library(True)
+        return None
+    program = _torch_compile(code, space)
+    if BACKEND == "torch" or (program is not None and device.type != "cpu"):
+        if program is None:
+            raise ValueError("Pixelbuster code uses jumps, which need the native pixelbuster library")
+        return program
+    if program is None:
+        _library(True)
+    elif _library() is None:
+        return program
+    return None
+
+def _compute_dtype(tensor: torch.Tensor) -> torch.dtype:
+    return tensor.dtype if tensor.dtype in [torch.float32, torch.float64] else torch.float32
+
+def _animate(externals: list[float], animation: str, frames: int) -> list[list[float]]:
+    """Per-frame e1-e9 values for a batch.
+    Each animation line overrides one external, either with a value per frame where the last one is held
+    `e1 0.0 0.5 1.0`
+    or with frame:value keyframes that get linearly interpolated and held past either end
+    `e6 0:0 60:100 119:0`"""
+    result = [list(externals) for _ in range(frames)]
+    for line in animation.lower().replace(',', ' ').splitlines():
+        line = line.split()
+        if not line or line[0].startswith('#'):
+            continue
+        if line[0] not in [f"e{n}" for n in range(1, 10)] or len(line) < 2:
+            raise ValueError(f"Invalid animation line '{' '.join(line)}'\nExpected an external e1-e9 followed by values or frame:value keyframes")
+        index = int(line[0][1]) - 1
+        if all(':' in v for v in line[1:]):
+            keys = sorted((int(f), float(v)) for f, v in [v.split(':') for v in line[1:]])
+            for frame in range(frames):
+                if frame <= keys[0][0]:
+                    value = keys[0][1]
+                elif frame >= keys[-1][0]:
+                    value = keys[-1][1]
+                else:
+                    (f0, v0), (f1, v1) = next((a, b) for a, b in zip(keys, keys[1:]) if a[0] <= frame < b[0])
+                    value = v0 + (v1 - v0) * (frame - f0) / (f1 - f0)
+                result[frame][index] = value
+        else:
+            values = [float(v) for v in line[1:]]
+            for frame in range(frames):
+                result[frame][index] = values[min(frame, len(values) - 1)]
+    return result
+
+# The native library only sees coordinates local to what it's given, so crops can't cut across these either
+HORIZONTAL_TOKENS = {"col", "xnorm", "width"}
+
+def _fit_mask(mask: torch.Tensor, frames: int, height: int, width: int, device: torch.device) -> torch.Tensor:
+    """A comfyui MASK as [frames, height, width], repeating its batch and resizing it as needed"""
+    mask = mask.to(device, torch.float32)
+    mask = mask.reshape(-1, *mask.shape[-2:])
+    if mask.shape[-2:] != (height, width):
+        mask = torch.nn.functional.interpolate(mask[:, None], size=(height, width), mode="bilinear", antialias=True)[:, 0]
+    return mask[torch.arange(frames) % len(mask)]
+
+def _mask_region(mask: torch.Tensor, program: Program | None) -> tuple[int, int, int, int] | None:
+    """Bounding box of every frame's nonzero mask area as (top, bottom, left, right), or None if there isn't any.
+    With a native program, axes its code depends on are kept whole"""
+    area = (mask > 0).any(0)
+    rows, cols = area.any(1).nonzero()[:, 0].tolist(), area.any(0).nonzero()[:, 0].tolist()
+    if not rows:
+        return None
+    top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    if program is not None and program.uses(VERTICAL_TOKENS):
+        top, bottom = 0, mask.shape[1]
+    if program is not None and program.uses(HORIZONTAL_TOKENS):
+        left, right = 0, mask.shape[2]
+    return top, bottom, left, right
+
+def _blend(original: torch.Tensor, processed: torch.Tensor, mask: torch.Tensor, region: tuple, channels_last: bool) -> torch.Tensor:
+    """Copy of original with the processed region blended in by the mask"""
+    top, bottom, left, right = region
+    result = original.to(processed.device, processed.dtype, copy=True)
+    weight = mask[:, top:bottom, left:right].to(processed.device, processed.dtype)
+    if channels_last:
+        result[:, top:bottom, left:right].lerp_(processed, weight[:, :, :, None])
+    else:
+        result[:, :, top:bottom, left:right].lerp_(processed, weight[:, None])
+    return result
+
+DEBUG = getenv('BSZ_CUI_DEBUG', False)
+
+def _digest(tensor: torch.Tensor) -> tuple:
+    """Fast content hash of a tensor along with everything else that makes it distinct"""
+    digest = hashlib.blake2b(tensor.detach().cpu().contiguous().view(torch.uint8).numpy(), digest_size=16).digest()
+    return (digest, tuple(tensor.shape), tensor.dtype, tensor.device)
+
+class ResultCache:
+    """LRU of node outputs keyed by a content hash of the input tensor plus everything else that affects the result.
+    Bounded by the total bytes of the outputs it holds, and disabled with a budget of 0"""
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = Lock()
+
+    def key(self, tensor: torch.Tensor, code: str, space: str, externals: list[list[float]], mask: torch.Tensor | None = None):
+        """None if the result shouldn't be cached"""
+        # programs using rand are expected to differ every run
+        if self.budget <= 0 or _compile(code, space).uses({"rand"}):
+            return None
+        return (_digest(tensor), code, space, tuple(map(tuple, externals)), None if mask is None else _digest(mask))
+
+    def get(self, key) -> torch.Tensor | None:
+        if key is None:
+            return None
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        if DEBUG: print(f"Pixelbuster result cache: {self.stats()}")
+        return result
+
+    def put(self, key, result: torch.Tensor):
+        size = result.numel() * result.element_size()
+        if key is None or size > self.budget:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = result
+            self.size += size
+            while self.size > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "bytes": self.size}
+
+# In megabytes. 0 or unset disables caching
+RESULT_CACHE = ResultCache(int(float(getenv('BSZ_PB_CACHE_MB', 0)) * 1024 ** 2))
 
 DEFAULT="""\
 # See the 'BSZ Pixelbuster Help'
@@ -138,6 +656,21 @@ class BSZPixelbuster:
                     "max": 100.0,
                     "step": 5.0
                 }),
+                "threads": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 256,
+                }),
+                "animation": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                }),
+                "mask": ("MASK",),
+                "strips": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 1024,
+                }),
             },
             "required": {
                 "image": ("IMAGE",),
@@ -159,27 +692,47 @@ class BSZPixelbuster:
 
     def pixelbuster(
         self, image, code: str,
-        e1=None, e2=None, e3=None, e4=None, e5=None, e6=None, e7=None, e8=None, e9=None
+        e1=None, e2=None, e3=None, e4=None, e5=None, e6=None, e7=None, e8=None, e9=None, threads=0, strips=0, animation="", mask=None
     ):
         if len(code.strip()) == 0:
             return (image,)
         externals = [e if e is not None else 0.0 for e in [e1, e2, e3, e4, e5, e6, e7, e8, e9]]
-        image = image.cpu().clone() # needs to clone or else the comfyui cache gets polluted
+        externals = _animate(externals, animation, len(image))
+        key = RESULT_CACHE.key(image, code, "srgba", externals, mask)
+        result = RESULT_CACHE.get(key)
+        if result is None:
+            result = self._pixelbuster(image, code, externals, threads, strips, mask)
+            RESULT_CACHE.put(key, result)
+        return (result,)
+
+    def _pixelbuster(self, image, code: str, externals: list[list[float]], threads: int, strips: int, mask):
         batch_size, height, width, channels = image.shape
-        for i in image:
-            ndarr = i.numpy()
-            buff = numpy.pad(ndarr, pad_width=((0, 0), (0, 0), (0, 1)), constant_values=1).flatten()
-            pb_lib.pixelbuster_ffi_ext(
-                code.encode('UTF-8'),
-                "srgba".encode('UTF-8'),
-                buff,
-                buff.nbytes,
+        torch_program = _torch_program(code, "srgb", image.device)
+        region = (0, height, 0, width)
+        if mask is not None:
+            mask = _fit_mask(mask, batch_size, height, width, image.device)
+            region = _mask_region(mask, _compile(code, "srgba") if torch_program is None else None)
+            if region is None:
+                return image
+        top, bottom, left, right = region
+        crop = image[:, top:bottom, left:right]
+        if torch_program is not None:
+            dtype = _compute_dtype(image)
+            ones = torch.ones((), dtype=dtype, device=image.device)
+            pixels = torch_program.run(
+                [crop[:, :, :, n].to(dtype) if n < channels else ones for n in range(4)],
+                torch.tensor(externals),
+                torch.arange(left, right),
+                torch.arange(top, bottom),
                 width,
-                *externals
+                height,
             )
-            ndarr[:] = buff.reshape(height, width, channels+1)[:, :, :-1]
-            del buff
-        return (image,)
+            result = torch.stack(pixels[:channels], dim=-1).to(image.dtype)
+        else:
+            result = _run_native(crop, _compile(code, "srgba"), externals, threads, strips)
+        if mask is None:
+            return result
+        return _blend(image, result, mask, region, channels_last=True)
     # }}}
 
 class BSZLatentbuster:
@@ -242,6 +795,16 @@ class BSZLatentbuster:
                     "max": 100.0,
                     "step": 5.0
                 }),
+                "threads": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 256,
+                }),
+                "animation": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                }),
+                "mask": ("MASK",),
             },
             "required": {
                 "latent": ("LATENT",),
@@ -263,28 +826,60 @@ class BSZLatentbuster:
 
     def latentbuster(
         self, latent, code: str,
-        e1=None, e2=None, e3=None, e4=None, e5=None, e6=None, e7=None, e8=None, e9=None
+        e1=None, e2=None, e3=None, e4=None, e5=None, e6=None, e7=None, e8=None, e9=None, threads=0, animation="", mask=None
     ):
         if len(code.strip()) == 0:
             return (latent,)
         externals = [e if e is not None else 0.0 for e in [e1, e2, e3, e4, e5, e6, e7, e8, e9]]
-        latent = latent.copy()
-        samples = latent['samples'].cpu().clone()
+        externals = _animate(externals, animation, len(latent['samples']))
+        key = RESULT_CACHE.key(latent['samples'], code, "laba", externals, mask)
+        samples = RESULT_CACHE.get(key)
+        if samples is None:
+            samples = self._latentbuster(latent['samples'], code, externals, threads, mask)
+            RESULT_CACHE.put(key, samples)
+        return (latent | {'samples': samples},)
+
+    def _latentbuster(self, samples, code: str, externals: list[list[float]], threads: int, mask):
         batch_size, channels, height, width = samples.shape
-        for batch in samples:
-            ndarr = batch.numpy()
-            buff = ndarr.swapaxes(1, 2).reshape(channels*height*width, order='F')
-            pb_lib.pixelbuster_ffi_ext(
-                code.encode('UTF-8'),
-                "laba".encode('UTF-8'),
-                buff,
-                buff.nbytes,
+        torch_program = _torch_program(code, "lab", samples.device)
+        region = (0, height, 0, width)
+        if mask is not None:
+            mask = _fit_mask(mask, batch_size, height, width, samples.device)
+            region = _mask_region(mask, _compile(code, "laba") if torch_program is None else None)
+            if region is None:
+                return samples
+        top, bottom, left, right = region
+        crop = samples[:, :, top:bottom, left:right]
+        if torch_program is not None:
+            dtype = _compute_dtype(samples)
+            ones = torch.ones((), dtype=dtype, device=samples.device)
+            pixels = torch_program.run(
+                [crop[:, n].to(dtype) if n < channels else ones for n in range(4)],
+                torch.tensor(externals),
+                torch.arange(left, right),
+                torch.arange(top, bottom),
                 width,
-                *externals
+                height,
             )
-            ndarr[:] = buff.reshape(channels, height, width, order='F').swapaxes(1, 2)
-        latent['samples'] = samples
-        return (latent,)
+            # channels past the 4th are passed through untouched
+            result = torch.stack(pixels[:channels] + list(crop[:, 4:].unbind(1)), dim=1).to(samples.dtype)
+        else:
+            result = self._latentbuster_native(crop, _compile(code, "laba"), externals, threads)
+        if mask is None:
+            return result
+        return _blend(samples, result, mask, region, channels_last=False)
+
+    def _latentbuster_native(self, samples, program: Program, externals: list[list[float]], threads: int):
+        batch_size, channels, height, width = samples.shape
+        # A single batched interleave into pixelbuster's pixel layout, which doubles as the output.
+        # Permuted back it's a channels_last [B, C, H, W] tensor, so nothing gets copied on the way out
+        buff = torch.empty([batch_size, height, width, channels], dtype=torch.float32)
+        buff.copy_(samples.permute(0, 2, 3, 1))
+        pixels = buff.numpy()
+        def run(_worker, n):
+            program.run(pixels[n].reshape(-1), width, externals[n])
+        _threaded(run, batch_size, threads)
+        return buff.permute(0, 3, 1, 2).to(samples.dtype)
     # }}}
 
 class BSZPixelbusterHelp:
@@ -297,7 +892,7 @@ class BSZPixelbusterHelp:
             "optional": {
                 "help": ("STRING", {
                     "multiline": True,
-                    "default": HELP
+                    "default": _help()
                 }),
             },
         }
@@ -312,3 +907,86 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "BSZLatentbuster": "BSZ Latentbuster",
     "BSZPixelbusterHelp": "BSZ Pixelbuster Help"
 }
+
+def stream_file(
+    src: str, dst: str, code: str, externals: list[float] | None = None,
+    max_memory: int = 256 * 1024 ** 2, threads: int = 0, raw_shape: tuple[int, int, int] | None = None
+):
+    """Runs pixelbuster code over a [height, width, channels] sRGB image stored in a .npy file,
+    or in a raw float32 file when raw_shape is given, writing a float32 result in the same format to dst.
+    The files are memory mapped one strip of rows at a time so peak memory stays near max_memory bytes
+    no matter how large the image is. Coordinates are always those of the whole image"""
+    externals = (list(externals or []) + [0.0] * 9)[:9]
+    if raw_shape is None:
+        header = numpy.load(src, mmap_mode='r')
+        dtype, shape, offset = header.dtype, header.shape, header.offset
+        # strips are mapped as runs of whole rows, which a Fortran ordered file doesn't store contiguously
+        fortran = header.flags.f_contiguous and not header.flags.c_contiguous
+        del header
+        if fortran:
+            raise ValueError(f"'{src}' is stored in Fortran order, save it in C order to stream it")
+        header = numpy.lib.format.open_memmap(dst, mode='w+', dtype=numpy.float32, shape=shape)
+        dst_offset = header.offset
+        del header
+    else:
+        dtype, shape, offset, dst_offset = numpy.dtype(numpy.float32), tuple(raw_shape), 0, 0
+        with open(dst, 'wb') as f:
+            f.truncate(int(numpy.prod(shape)) * 4)
+    height, width, channels = shape
+
+    # native strips would only see strip local rows, so anything depending on them goes through torch
+    torch_program = None
+    if BACKEND == "torch" or _compile(code, "srgba").uses(VERTICAL_TOKENS) or _library() is None:
+        torch_program = _torch_compile(code, "srgb")
+        if torch_program is None:
+            raise ValueError("Streamed code using row/ynorm/height or running without the native library can't use jumps")
+    # mapped and copied input, mapped and computed output, and the RGBA working set,
+    # which is a good deal larger for torch's temporaries
+    row_bytes = width * (channels * dtype.itemsize * 2 + channels * 4 * 2 + 16 * (8 if torch_program is not None else 1))
+    rows = max(1, min(height, int(max_memory) // row_bytes))
+
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        src_strip = numpy.memmap(src, dtype, 'r', offset + top * width * channels * dtype.itemsize, (bottom - top, width, channels))
+        strip = torch.from_numpy(numpy.array(src_strip, dtype=numpy.float32))[None]
+        del src_strip
+        if torch_program is not None:
+            ones = torch.ones((), dtype=torch.float32)
+            pixels = torch_program.run(
+                [strip[:, :, :, n] if n < channels else ones for n in range(4)],
+                torch.tensor([externals]),
+                torch.arange(width),
+                torch.arange(top, bottom),
+                width,
+                height,
+            )
+            result = torch.stack(pixels[:channels], dim=-1)
+            del pixels
+        else:
+            result = _run_native(strip, _compile(code, "srgba"), [externals], threads, 0)
+        dst_strip = numpy.memmap(dst, numpy.float32, 'r+', dst_offset + top * width * channels * 4, (bottom - top, width, channels))
+        dst_strip[:] = result[0].numpy()
+        dst_strip.flush()
+        del dst_strip, strip, result
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Streams pixelbuster code over an image file too large to comfortably fit in memory")
+    parser.add_argument('input', help=".npy file holding a [height, width, channels] sRGB float image, or a raw float32 file with --raw")
+    parser.add_argument('output', help="File to write the float32 result to, in the same format as the input")
+    parser.add_argument('-c', '--code', help="Pixelbuster code")
+    parser.add_argument('-f', '--code-file', help="File to read the pixelbuster code from instead")
+    parser.add_argument('-e', '--externals', type=float, nargs='+', default=[], help="Values for e1 through e9")
+    parser.add_argument('-m', '--max-memory', type=float, default=256, help="Approximate memory budget in megabytes. Default 256")
+    parser.add_argument('-t', '--threads', type=int, default=0, help="Worker threads. Default is the core count")
+    parser.add_argument('--raw', type=int, nargs=3, metavar=('HEIGHT', 'WIDTH', 'CHANNELS'), help="Treat the input as raw float32 of this shape")
+
+    args = parser.parse_args()
+    if args.code_file is not None:
+        with open(args.code_file) as f:
+            args.code = f.read()
+    if not args.code:
+        parser.error("one of --code or --code-file is required")
+
+    stream_file(args.input, args.output, args.code, args.externals, int(args.max_memory * 1024 ** 2), args.threads, args.raw)
@@ -1,14 +1,24 @@
 import torch
 import comfy
+import comfy.model_management
+import comfy.sd1_clip
 import nodes
 import comfy_extras.nodes_clip_sdxl as nodes_xl
 # Scale
 import folder_paths
 import comfy_extras.nodes_upscale_model as nodes_scale
 
+import math
+import os.path
+import weakref
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from os import getenv
+from threading import Lock
 
 DEBUG = getenv('BSZ_CUI_DEBUG', False)
+NOISE_THREADS = int(getenv('BSZ_NOISE_THREADS', 1))
 
 # maintain pointer to the old FN so it's never lost in errs
 OLD_PREPARE_NOISE = comfy.sample.prepare_noise
@@ -18,15 +28,24 @@ METHODS_PIXEL = { f"pixel {x}": x for x in nodes.ImageScale.upscale_methods }
 METHODS_MODEL = { f"model {x}": x for x in folder_paths.get_filename_list("upscale_models")}
 
 def _prepare_noise(latent_image, seed, noise_inds=None):
-    b, c, h, w = latent_image.shape
-    slices = []
-    if noise_inds is not None:
-        for n in noise_inds:
-            slices.append(torch.randn([1, c, h, w], dtype=latent_image.dtype, layout=latent_image.layout, generator=torch.manual_seed(seed+n), device="cpu"))
+    seeds = [seed + n for n in (noise_inds if noise_inds is not None else range(len(latent_image)))]
+    noise = torch.empty([len(seeds)] + list(latent_image.shape[1:]), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
+    if NOISE_THREADS > 1 and len(seeds) > 1:
+        # Each item only depends on its own seed, so items can be drawn from private generators in parallel.
+        # Every generator is then left where the serial loop would have left it: manual_seed reseeds
+        # the other devices like the loop's last call did, and the CPU one picks up after the last draw
+        def generate(n):
+            generator = torch.Generator().manual_seed(seeds[n])
+            torch.randn(noise.shape[1:], generator=generator, out=noise[n])
+            return generator
+        with ThreadPoolExecutor(min(NOISE_THREADS, len(seeds))) as pool:
+            generators = list(pool.map(generate, range(len(seeds))))
+        torch.manual_seed(seeds[-1])
+        torch.default_generator.set_state(generators[-1].get_state())
     else:
-        for n in range(seed, seed+b):
-            slices.append(torch.randn([1, c, h, w], dtype=latent_image.dtype, layout=latent_image.layout, generator=torch.manual_seed(n), device="cpu"))
-    return torch.cat(slices, axis=0)
+        for n, s in enumerate(seeds):
+            torch.randn(noise.shape[1:], generator=torch.manual_seed(s), out=noise[n])
+    return noise
 
 def roundint(n: int, step: int) -> int:
     if n % step >= step/2:
@@ -34,6 +53,140 @@ def roundint(n: int, step: int) -> int:
     else:
         return int(n - (n % step))
 
+class _Recorded(Exception):
+    """Aborts an encode once an encoder's missing token rows have been recorded"""
+
+class _Unbatchable(Exception):
+    """Raised when a CLIP doesn't look the way _encode_batch expects"""
+
+def _hooked(clip) -> bool:
+    """Whether the CLIP's weights can change between encoder calls, through hooks or scheduled encodes.
+    Replayed rows are only keyed by their tokens, so these can't be batched"""
+    patcher = getattr(clip, "patcher", None)
+    return bool(
+        getattr(clip, "use_clip_schedule", False) or getattr(clip, "apply_hooks_to_conds", None)
+        or getattr(patcher, "hook_patches", None) or getattr(patcher, "forced_hooks", None)
+    )
+
+def _encode_batch(clip, encodes: list) -> list:
+    """Runs several zero argument text encodes for the same CLIP with one forward pass per text encoder.
+
+    The token rows each encode sends to the encoders are recorded by patching the `encode` of every
+    ClipTokenWeightEncoder in the CLIP, aborting at the first encoder whose rows haven't been seen yet.
+    Once every encode has been recorded, the unique rows go through that encoder as a single batch,
+    and the encodes are run again until they complete by replaying the cached rows.
+    Any exception raised along the way other than an interrupt falls back to running each encode on its own,
+    as does a CLIP with hooks"""
+    encoders = [m for m in clip.cond_stage_model.modules() if isinstance(m, comfy.sd1_clip.ClipTokenWeightEncoder)]
+    if len(encodes) < 2 or len(encoders) == 0 or _hooked(clip):
+        return [encode() for encode in encodes]
+
+    originals = [encoder.encode for encoder in encoders]
+    rows = [{} for _ in encoders]
+    pending = [[] for _ in encoders]
+
+    def replay(n):
+        def encode(tokens):
+            keys = []
+            for row in tokens:
+                # embeddings are per-tokenize tensors that can never be matched again
+                if not all(isinstance(t, int) for t in row):
+                    raise _Unbatchable()
+                keys.append(tuple(row))
+            missing = [key for key in keys if key not in rows[n]]
+            if missing:
+                pending[n] += missing
+                raise _Recorded()
+            outputs = [rows[n][key] for key in keys]
+            return tuple(
+                None if outputs[0][i] is None else torch.stack([output[i] for output in outputs])
+                for i in range(len(outputs[0]))
+            )
+        return encode
+
+    results = [None] * len(encodes)
+    try:
+        for n, encoder in enumerate(encoders):
+            encoder.encode = replay(n)
+        while True:
+            for n, encode in enumerate(encodes):
+                if results[n] is None:
+                    try:
+                        results[n] = encode()
+                    except _Recorded:
+                        pass
+            if all(len(p) == 0 for p in pending):
+                break
+            # the aborted encodes already set the clip layer options, so only the weights need loading
+            clip.load_model()
+            for n, keys in enumerate(pending):
+                keys = list(dict.fromkeys(keys))
+                pending[n] = []
+                for length in set(map(len, keys)):
+                    batch = [key for key in keys if len(key) == length]
+                    output = originals[n]([list(key) for key in batch])
+                    if not all(x is None or (isinstance(x, torch.Tensor) and len(x) == len(batch)) for x in output):
+                        raise _Unbatchable()
+                    for i, key in enumerate(batch):
+                        rows[n][key] = tuple(None if x is None else x[i] for x in output)
+                    if DEBUG: print(f"Batched {len(batch)} token rows through {type(encoders[n]).__name__}")
+    except comfy.model_management.InterruptProcessingException:
+        raise
+    except Exception as e:
+        # this leans on comfy internals, so any failure, not just a known shape mismatch,
+        # gets a clean retry through the public path instead of breaking sampling
+        if DEBUG: print(f"Batched encode failed, encoding each text on its own: {e!r}")
+        results = None
+    finally:
+        for encoder in encoders:
+            vars(encoder).pop("encode", None)
+    if results is None:
+        return [encode() for encode in encodes]
+    return results
+
+class CondCache:
+    """LRU of encoded conditioning keyed by the CLIP object plus every input its encode depends on.
+    Bounded by entry count, and disabled with a size of 0"""
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = Lock()
+
+    def get(self, clip, key: tuple):
+        if self.size <= 0:
+            return None
+        key = (id(clip),) + key
+        with self.lock:
+            entry = self.entries.get(key)
+            # ids get reused once a CLIP is freed, so the weakref makes sure it's still the same object
+            if entry is None or entry[0]() is not clip:
+                self.misses += 1
+                cond = None
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                cond = entry[1]
+        if DEBUG: print(f"Conditioning cache: {self.stats()}")
+        # fresh lists and dicts so downstream nodes can't edit the cached copy
+        return None if cond is None else [[t, d.copy()] for t, d in cond]
+
+    def put(self, clip, key: tuple, cond):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[(id(clip),) + key] = (weakref.ref(clip), [[t, d.copy()] for t, d in cond])
+            self.entries.move_to_end((id(clip),) + key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries)}
+
+# In entries. 0 disables caching
+COND_CACHE = CondCache(int(getenv('BSZ_COND_CACHE', 64)))
+
 class CondStage:
     def __init__(self, text: str, xl_target="1k", refiner_asc=6.0):
         self.text = text
@@ -44,6 +197,22 @@ class CondStage:
         return self._encode(latent, clip)
 
     def _encode(self, latent, clip):
+        return CondStage.encode_batch([self], latent, clip)[0]
+
+    @staticmethod
+    def encode_batch(stages: list, latent, clip) -> list:
+        """Conditioning for several stages sharing a latent and clip.
+        Every cache miss is encoded together through _encode_batch"""
+        prepared = [stage._prepare(latent, clip) for stage in stages]
+        conds = [COND_CACHE.get(clip, key) for key, _ in prepared]
+        missing = [n for n, cond in enumerate(conds) if cond is None]
+        for n, cond in zip(missing, _encode_batch(clip, [prepared[n][1] for n in missing])):
+            COND_CACHE.put(clip, prepared[n][0], cond)
+            conds[n] = cond
+        return conds
+
+    def _prepare(self, latent, clip):
+        """(cache key, zero argument encode) for this stage"""
         # {{{
         height, width = latent["samples"].size()[2:4]
         height *= 8
@@ -71,6 +240,15 @@ class CondStage:
         if DEBUG: print(f"\nText:\n{self.text}")
         if DEBUG: print(f"\nXL: {XL}\nREF: {REF}\nW / H: {width} / {height}\nTW / TH: {target_width} / {target_height}\nASC: {self.refiner_asc}\n")
 
+        # only what the chosen encode actually reads goes in the key
+        if XL: key = (self.text, "xl", width, height, target_width, target_height)
+        elif REF: key = (self.text, "refiner", self.refiner_asc, width, height)
+        else: key = (self.text,)
+        return key, lambda: self._encode_uncached(clip, XL, REF, width, height, target_width, target_height)
+        # }}}
+
+    def _encode_uncached(self, clip, XL, REF, width, height, target_width, target_height):
+        # {{{
         if XL: return nodes_xl.CLIPTextEncodeSDXL.encode(
             None,
             clip,
@@ -108,6 +286,79 @@ class CondBreak(CondStage):
         cond = self._encode(latent, clip)
         return nodes.ConditioningConcat.concat(None, other, cond)[0]
 
+class UpscaleModelCache:
+    """LRU of loaded upscale models keyed by filename and modification time.
+    Bounded by the total bytes of their weights, and disabled with a budget of 0"""
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = Lock()
+
+    def load(self, name: str):
+        # a changed file gets a new key, and its stale entry ages out
+        key = (name, os.path.getmtime(folder_paths.get_full_path("upscale_models", name)))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        if DEBUG: print(f"Upscale model cache: {self.stats()}")
+        if entry is not None:
+            return entry[0]
+
+        model = nodes_scale.UpscaleModelLoader.load_model(None, name)[0]
+        # spandrel descriptors wrap the actual torch module
+        module = getattr(model, "model", model)
+        size = sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+        if size <= self.budget:
+            with self.lock:
+                self.entries[key] = (model, size)
+                self.size += size
+                while self.size > self.budget:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.size -= evicted
+                    self.evictions += 1
+        return model
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "bytes": self.size}
+
+# In megabytes. 0 disables caching
+UPSCALE_MODEL_CACHE = UpscaleModelCache(int(float(getenv('BSZ_UPSCALE_CACHE_MB', 1024)) * 1024 ** 2))
+
+def unload_upscale_models():
+    """Drops every cached upscale model so its memory can be freed"""
+    UPSCALE_MODEL_CACHE.clear()
+
+# ComfyUI frees memory through this, so cached upscale models go along with everything else
+OLD_UNLOAD_ALL_MODELS = comfy.model_management.unload_all_models
+
+def _unload_all_models(*args, **kwargs):
+    unload_upscale_models()
+    return OLD_UNLOAD_ALL_MODELS(*args, **kwargs)
+
+comfy.model_management.unload_all_models = _unload_all_models
+
+def _feather(length: int, start: bool, end: bool, ramp: int) -> torch.Tensor:
+    """1D tile weight fading in over `ramp` at the start and out at the end when those edges meet another tile.
+    Opposite ramps of neighbouring tiles sum to 1"""
+    weight = torch.ones([length])
+    fade = (torch.arange(ramp) + 0.5) / ramp
+    if start:
+        weight[:ramp] = fade[:length]
+    if end:
+        weight[-ramp:] *= fade.flip(0)[-length:]
+    return weight
+
 class BSZPrincipledScale:
     #{{{
     @classmethod
@@ -120,13 +371,17 @@ class BSZPrincipledScale:
                 "width": ("INT", {"default": 1024, "min": 64, "max": nodes.MAX_RESOLUTION, "step": 8}),
                 "height": ("INT", {"default": 1024, "min": 64, "max": nodes.MAX_RESOLUTION, "step": 8}),
             },
+            "optional": {
+                "tile_size": ("INT", {"default": 0, "min": 0, "max": nodes.MAX_RESOLUTION, "step": 64}),
+                "batch_chunk": ("INT", {"default": 0, "min": 0, "max": 4096}),
+            },
         }
 
     RETURN_TYPES = ("LATENT",)
     FUNCTION = "scale"
     CATEGORY = "beinsezii/image"
 
-    def scale(self, vae, latent, method, width, height):
+    def scale(self, vae, latent, method, width, height, tile_size=0, batch_chunk=0):
         latent_height, latent_width = latent["samples"].size()[2:4]
         latent_height *= 8
         latent_width *= 8
@@ -134,24 +389,106 @@ class BSZPrincipledScale:
         if latent_width != width or latent_height != height:
             if method in METHODS_LATENT:
                 latent = nodes.LatentUpscale.upscale(None, latent, METHODS_LATENT[method], width, height, "disabled")[0]
+            elif 0 < batch_chunk < len(latent["samples"]):
+                latent = {"samples": self._scale_chunked(vae, latent["samples"], method, width, height, tile_size, batch_chunk)}
+            elif tile_size > 0:
+                latent = {"samples": self._scale_tiled(vae, latent["samples"], method, width, height, tile_size)}
             else:
                 decoder = nodes.VAEDecode()
                 pixels = decoder.decode(vae, latent)[0]
                 del decoder
-                if method in METHODS_PIXEL:
-                    pixels = nodes.ImageScale.upscale(None, pixels, METHODS_PIXEL[method], width, height, "disabled")[0]
-                elif method in METHODS_MODEL:
-                    scale_model = nodes_scale.UpscaleModelLoader.load_model(None, METHODS_MODEL[method])[0]
-                    pixels = nodes_scale.ImageUpscaleWithModel.upscale(None, scale_model, pixels)[0]
-                    del scale_model
-                    pixels = nodes.ImageScale.upscale(None, pixels, 'bicubic', width, height, "disabled")[0]
-                else:
-                    raise ValueError("Unreachable!")
+                pixels = self._scale_pixels(pixels, method, width, height)
 
                 encoder = nodes.VAEEncode()
                 latent = encoder.encode(vae, pixels)[0]
                 del pixels, encoder
         return (latent,)
+
+    def _scale_pixels(self, pixels, method, width, height):
+        if method in METHODS_PIXEL:
+            return nodes.ImageScale.upscale(None, pixels, METHODS_PIXEL[method], width, height, "disabled")[0]
+        elif method in METHODS_MODEL:
+            scale_model = UPSCALE_MODEL_CACHE.load(METHODS_MODEL[method])
+            pixels = nodes_scale.ImageUpscaleWithModel.upscale(None, scale_model, pixels)[0]
+            del scale_model
+            return nodes.ImageScale.upscale(None, pixels, 'bicubic', width, height, "disabled")[0]
+        else:
+            raise ValueError("Unreachable!")
+
+    def _scale_chunked(self, vae, samples, method, width, height, tile_size, batch_chunk):
+        """Streams batch chunks through decode -> scale -> encode into one preallocated latent,
+        so only a couple chunks are ever in pixel space.
+        Pixel methods are plain CPU torch ops, so a chunk is scaled on a worker thread while the next one decodes.
+        The VAE and upscale models always run on the calling thread"""
+        result = None
+        def store(start, encoded):
+            nonlocal result
+            if result is None:
+                result = torch.empty([len(samples)] + list(encoded.shape[1:]), dtype=encoded.dtype, device=encoded.device)
+            result[start:start + len(encoded)] = encoded
+
+        with ThreadPoolExecutor(1) as pool:
+            pending = None
+            for start in range(0, len(samples), batch_chunk):
+                chunk = samples[start:start + batch_chunk]
+                if tile_size > 0:
+                    store(start, self._scale_tiled(vae, chunk, method, width, height, tile_size))
+                    continue
+                pixels = nodes.VAEDecode().decode(vae, {"samples": chunk})[0]
+                if method in METHODS_PIXEL:
+                    scaled = pool.submit(self._scale_pixels, pixels, method, width, height)
+                else:
+                    scaled = Future()
+                    scaled.set_result(self._scale_pixels(pixels, method, width, height))
+                del pixels
+                if pending is not None:
+                    store(pending[0], nodes.VAEEncode().encode(vae, pending[1].result())[0]["samples"])
+                pending = (start, scaled)
+            if pending is not None:
+                store(pending[0], nodes.VAEEncode().encode(vae, pending[1].result())[0]["samples"])
+        return result
+
+    def _scale_tiled(self, vae, samples, method, width, height, tile_size):
+        """Decode -> scale -> encode one overlapping tile of the output at a time, crossfading the overlaps,
+        so pixel space memory depends on the tile size instead of the output size.
+        Each tile decodes its matching input area plus some context so the decoder sees past the seams"""
+        _, _, h, w = samples.shape
+        out_h, out_w = height // 8, width // 8
+        # all in latent pixels
+        tile = max(1, tile_size // 8)
+        overlap = max(1, tile // 8)
+        ry, rx = h / out_h, w / out_w
+
+        result, weights = None, torch.zeros([1, 1, out_h, out_w])
+        for ty in range(0, out_h, tile):
+            for tx in range(0, out_w, tile):
+                # output area of this tile plus its overlap
+                ey0, ey1 = max(0, ty - overlap), min(out_h, ty + tile + overlap)
+                ex0, ex1 = max(0, tx - overlap), min(out_w, tx + tile + overlap)
+                # input area covering it plus decoder context
+                iy0, iy1 = max(0, math.floor(ey0 * ry) - overlap), min(h, math.ceil(ey1 * ry) + overlap)
+                ix0, ix1 = max(0, math.floor(ex0 * rx) - overlap), min(w, math.ceil(ex1 * rx) + overlap)
+
+                # where the tile's output area starts inside the scaled input area.
+                # Both ends are rounded separately, so the scaled size is stretched if the crop would run a pixel past it
+                top, left = round((ey0 - iy0 / ry) * 8), round((ex0 - ix0 / rx) * 8)
+                scaled_h = max(round((iy1 - iy0) * 8 / ry), top + (ey1 - ey0) * 8)
+                scaled_w = max(round((ix1 - ix0) * 8 / rx), left + (ex1 - ex0) * 8)
+
+                pixels = nodes.VAEDecode().decode(vae, {"samples": samples[:, :, iy0:iy1, ix0:ix1]})[0]
+                pixels = self._scale_pixels(pixels, method, scaled_w, scaled_h)
+                pixels = pixels[:, top:top + (ey1 - ey0) * 8, left:left + (ex1 - ex0) * 8]
+                encoded = nodes.VAEEncode().encode(vae, pixels)[0]["samples"]
+                del pixels
+
+                if result is None:
+                    result = torch.zeros([encoded.shape[0], encoded.shape[1], out_h, out_w], dtype=encoded.dtype, device=encoded.device)
+                weight = _feather(ey1 - ey0, ey0 > 0, ey1 < out_h, overlap * 2).view(-1, 1) \
+                    * _feather(ex1 - ex0, ex0 > 0, ex1 < out_w, overlap * 2).view(1, -1)
+                result[:, :, ey0:ey1, ex0:ex1] += encoded * weight.to(encoded.device, encoded.dtype)
+                weights[:, :, ey0:ey1, ex0:ex1] += weight
+                del encoded
+        return result.div_(weights.to(result.device, result.dtype))
     # }}}
 
 class BSZPrincipledConditioning:
@@ -174,6 +511,30 @@ class BSZPrincipledConditioning:
         return (CondStage(text, xl_target, refiner_asc).process(latent, clip, None),)
     # }}}
 
+class BSZUnloadUpscaleModels:
+    # {{{
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "optional": {
+                "image": ("IMAGE",),
+            }
+        }
+    RETURN_TYPES = ("IMAGE",)
+    CATEGORY = "beinsezii/image"
+    FUNCTION = "unload"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def IS_CHANGED(s, image=None):
+        # nothing to cache, it has to run every time
+        return float("nan")
+
+    def unload(self, image=None):
+        unload_upscale_models()
+        return (image,)
+    # }}}
+
 class BSZPrincipledSampler:
     # {{{
     @classmethod
@@ -286,6 +647,7 @@ class BSZPrincipledSampler:
         if base_start < base_end:
             if DEBUG: print(f"Running Base - total: {steps} start: {base_start} end: {base_end}")
             try:
+                positive, negative = CondStage.encode_batch([CondStage(positive_prompt), CondStage(negative_prompt)], latent, base_clip)
                 latent = nodes.common_ksampler(
                     base_model,
                     seed,
@@ -293,8 +655,8 @@ class BSZPrincipledSampler:
                     cfg,
                     sampler,
                     scheduler,
-                    BSZPrincipledConditioning.encode(None, latent, base_clip, positive_prompt)[0],
-                    BSZPrincipledConditioning.encode(None, latent, base_clip, negative_prompt)[0],
+                    positive,
+                    negative,
                     latent,
                     start_step=base_start,
                     last_step=None if base_end == steps else base_end,
@@ -309,6 +671,11 @@ class BSZPrincipledSampler:
         if base_end < steps:
             if DEBUG: print(f"Running Refiner - total: {steps} start: {base_end} ascore: +{refiner_asc_pos} -{refiner_asc_neg}")
             try:
+                positive, negative = CondStage.encode_batch(
+                    [CondStage(positive_prompt, refiner_asc=refiner_asc_pos), CondStage(negative_prompt, refiner_asc=refiner_asc_neg)],
+                    latent,
+                    refiner_clip,
+                )
                 latent = nodes.common_ksampler(
                     refiner_model,
                     seed,
@@ -316,8 +683,8 @@ class BSZPrincipledSampler:
                     cfg,
                     sampler,
                     scheduler,
-                    BSZPrincipledConditioning.encode(None, latent, refiner_clip, positive_prompt, refiner_asc=refiner_asc_pos)[0],
-                    BSZPrincipledConditioning.encode(None, latent, refiner_clip, negative_prompt, refiner_asc=refiner_asc_neg)[0],
+                    positive,
+                    negative,
                     latent,
                     start_step=base_end,
                     force_full_denoise=True,
@@ -352,9 +719,11 @@ NODE_CLASS_MAPPINGS = {
     "BSZPrincipledSampler": BSZPrincipledSampler,
     "BSZPrincipledScale": BSZPrincipledScale,
     "BSZPrincipledConditioning": BSZPrincipledConditioning,
+    "BSZUnloadUpscaleModels": BSZUnloadUpscaleModels,
 }
 NODE_DISPLAY_NAME_MAPPINGS = {
     "BSZPrincipledSampler": "BSZ Principled Sampler",
     "BSZPrincipledScale": "BSZ Principled Scale",
     "BSZPrincipledConditioning": "BSZ Principled Conditioning",
+    "BSZUnloadUpscaleModels": "BSZ Unload Upscale Models",
 }
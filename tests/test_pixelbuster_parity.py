@@ -0,0 +1,88 @@
+"""
+Parity between BSZPixelbuster's torch backend and the native pixelbuster library.
+
+Needs the library for this platform next to bsz-pixelbuster.py, but not ComfyUI.
+Run with `python -m pytest tests/test_pixelbuster_parity.py`
+
+Tolerance: results agree to 1e-4 relative, measured against max(|native|, 1), and NaN/inf land in the same places.
+That holds for code whose values stay within a few orders of magnitude of the usual 0-1/0-100 ranges.
+Both backends compute in float32 but don't round identically, so code that pushes a channel far out of range
+and then converts colorspaces can lose most of a small channel's precision to cancellation,
+and the two backends then differ by roughly float32 epsilon times the largest channel magnitude
+"""
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+import torch
+
+spec = importlib.util.spec_from_file_location("bsz_pixelbuster", Path(__file__).resolve().parents[1] / "bsz-nodes" / "bsz-pixelbuster.py")
+pixelbuster = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pixelbuster)
+if pixelbuster._library() is None:
+    pytest.skip(f"pixelbuster library '{pixelbuster.LIBRARY}' can't be loaded", allow_module_level=True)
+
+TOLERANCE = 1e-4
+SPACES = ["srgb", "lrgb", "hsv", "xyz", "lab", "lch"]
+OPERANDS = ["0.37", "-1.6", "2", "c2", "xnorm", "pi", "e1"]
+EXTERNALS = dict(e1=0.3, e2=0.7, e4=-0.5, e8=20.0)
+
+def image() -> torch.Tensor:
+    torch.manual_seed(0)
+    img = torch.rand([2, 13, 17, 3])
+    # black, white, gray, a primary, and a near black
+    img[0, 0, :5] = torch.tensor([[0, 0, 0], [1, 1, 1], [0.5, 0.5, 0.5], [1, 0, 0], [0.001, 0.002, 0.0]])
+    return img
+
+IMAGE = image()
+
+def run(code: str, backend: str) -> torch.Tensor:
+    pixelbuster.BACKEND = backend
+    try:
+        return pixelbuster.BSZPixelbuster().pixelbuster(IMAGE, code, **EXTERNALS)[0]
+    finally:
+        pixelbuster.BACKEND = "auto"
+
+def assert_parity(code: str):
+    native, torched = run(code, "native"), run(code, "torch")
+    assert torch.equal(native.isnan(), torched.isnan()), f"NaN placement differs for {code!r}"
+    assert torch.equal(native.isinf(), torched.isinf()), f"inf placement differs for {code!r}"
+    finite = native.isfinite() & torched.isfinite()
+    if finite.any():
+        error = ((native - torched).abs() / native.abs().clamp(min=1))[finite].max().item()
+        assert error <= TOLERANCE, f"{code!r} differs by {error}"
+
+@pytest.mark.parametrize("op", sorted(pixelbuster.OPS))
+def test_ops(op: str):
+    binary = pixelbuster.OPS[op][0]
+    for operand in OPERANDS if binary else ["0"]:
+        assert_parity(f"c1 {op} {operand}\nv1 = c3\nv1 {op} {operand}\nc2 = v1")
+
+@pytest.mark.parametrize("comparison", sorted(pixelbuster.COMPARISONS))
+def test_ifs(comparison: str):
+    assert_parity(f"if c1 {comparison} c2 c3 = 0.25")
+    assert_parity(f"if c1 {comparison} 0.5 if c2 {comparison} xnorm c1 * 2")
+
+def test_swaps():
+    assert_parity("swap c1 c3")
+    assert_parity("hsv\nswap h v\nsrgb\nswap r g")
+    assert_parity("if c1 > 0.5 swap c2 c3")
+
+@pytest.mark.parametrize("start", SPACES)
+def test_colorspace_chains(start: str):
+    for end in SPACES:
+        assert_parity(f"{start}\nc1 * 0.9\nc2 + 0.05\n{end}\nc3 * 1.1\nc2 - 0.02")
+
+def test_nan_and_inf():
+    # NaN going into HSV and lab -> lch is where the backends used to disagree
+    assert_parity("c1 asin 2\nhsv")
+    assert_parity("c2 - 13\nhsv")
+    assert_parity("c1 log -1.6\nlch\nc2 * 2")
+    assert_parity("c3 / 0\nlab")
+
+def test_comments_and_continuations():
+    assert_parity("# note ; c1 = 0")
+    assert_parity("# c \\\nc1 = 0")
+    assert_parity("c1 = \\\n0 ; c2 = 0")
+    assert_parity("c1 = 0 \\\n# x\nc2 = 0")
@@ -0,0 +1,66 @@
+"""
+BSZPrincipledScale's tiled path against a stand-in VAE.
+
+Needs ComfyUI importable, which it is when this repo sits in ComfyUI's custom_nodes folder.
+Run from the ComfyUI root with `python -m pytest custom_nodes/bsz-cui-extras/tests`
+"""
+
+import importlib.util
+import random
+import resource
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+
+# this repo lives in ComfyUI/custom_nodes/, so ComfyUI itself is two levels above it
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+pytest.importorskip("nodes")
+
+spec = importlib.util.spec_from_file_location("bsz_principled", Path(__file__).resolve().parents[1] / "bsz-nodes" / "bsz-principled.py")
+principled = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(principled)
+
+class FakeVAE:
+    """Decodes by upsampling the first three channels 8x and encodes by 8x average pooling.
+    Records the largest pixel tensor it sees"""
+    def __init__(self):
+        self.peak = 0
+
+    def decode(self, samples):
+        pixels = torch.nn.functional.interpolate(samples[:, :3].float(), scale_factor=8).sigmoid().permute(0, 2, 3, 1)
+        self.peak = max(self.peak, pixels.numel())
+        return pixels
+
+    def encode(self, pixels):
+        self.peak = max(self.peak, pixels.numel())
+        # floors to whole latent pixels like comfy's own VAE crop
+        x = torch.nn.functional.avg_pool2d(pixels.permute(0, 3, 1, 2), 8)
+        return torch.cat([x, x.mean(1, keepdim=True)], 1)
+
+def scale(vae, samples, width, height, tile_size):
+    return principled.BSZPrincipledScale().scale(vae, {"samples": samples}, "pixel bilinear", width, height, tile_size)[0]["samples"]
+
+def test_tiled_rounding():
+    # the last row of tiles here used to come out one pixel short of a whole latent row
+    assert scale(FakeVAE(), torch.randn(1, 4, 32, 31), 312, 1528, 256).shape == (1, 4, 191, 39)
+
+def test_tiled_size_sweep():
+    rng = random.Random(0)
+    for _ in range(300):
+        h, w = rng.randint(1, 48), rng.randint(1, 48)
+        width, height = rng.randint(8, 200) * 8, rng.randint(8, 200) * 8
+        tile_size = rng.choice([64, 128, 192, 256, 320, 512])
+        result = scale(FakeVAE(), torch.randn(1, 4, h, w), width, height, tile_size)
+        assert result.shape == (1, 4, height // 8, width // 8), (h, w, width, height, tile_size)
+
+def test_tiled_memory():
+    # a 4096x4096 output is 200 MB of float pixels, the tiles should never get near that
+    vae = FakeVAE()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = scale(vae, torch.randn(1, 4, 256, 256), 4096, 4096, 512)
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * (1 if sys.platform == "darwin" else 1024)
+    assert result.shape == (1, 4, 512, 512)
+    assert vae.peak * 4 < 16 * 1024 ** 2
+    assert grown < 100 * 1024 ** 2